@@ -12,7 +12,9 @@ import json
 import os
 import sys
 import asyncio
+import threading
 import websockets
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 import psutil
 from aiohttp import web
@@ -24,6 +26,21 @@ SERVER_ID = os.getenv('KUNNA_SERVER_ID', socket.gethostname())
 HEARTBEAT_INTERVAL = int(os.getenv('KUNNA_HEARTBEAT_INTERVAL', '10'))
 TRAFFIC_API_PORT = int(os.getenv('KUNNA_TRAFFIC_PORT', '9000'))
 STATIC_ROUTES = os.getenv('KUNNA_STATIC_ROUTES', None)
+# Lecturas de stats de Docker en paralelo (cada una tarda ~1-2s) y tiempo máximo
+# de espera por heartbeat; por encima de ~10 se agota el pool de conexiones del SDK
+STATS_CONCURRENCY = int(os.getenv('KUNNA_STATS_CONCURRENCY', '8'))
+STATS_TIMEOUT = float(os.getenv('KUNNA_STATS_TIMEOUT', '5'))
+# Inventario de contenedores mantenido con el stream de eventos de Docker:
+# resincronización completa cada N segundos y espera para agrupar ráfagas de eventos
+INVENTORY_RESYNC = int(os.getenv('KUNNA_INVENTORY_RESYNC', '300'))
+INVENTORY_DEBOUNCE = float(os.getenv('KUNNA_INVENTORY_DEBOUNCE', '0.05'))
+# Heartbeats: 'delta' (snapshot al conectar y después solo cambios, si el central
+# lo soporta) o 'full' (snapshot completo en cada heartbeat)
+HEARTBEAT_MODE = os.getenv('KUNNA_HEARTBEAT_MODE', 'delta')
+INVENTORY_EVENTS = {
+    'create', 'start', 'restart', 'die', 'stop', 'kill', 'oom',
+    'pause', 'unpause', 'destroy', 'rename', 'update',
+}
 
 class KunnaAgent:
     def __init__(self):
@@ -31,6 +48,25 @@ class KunnaAgent:
         self.websocket = None
         self.server_info = self.get_server_info()
         self.traffic_buffer = []  # Buffer para eventos de tráfico
+        # Pool acotado para container.stats(): no se esperan en serie
+        self.stats_pool = ThreadPoolExecutor(max_workers=max(1, STATS_CONCURRENCY),
+                                             thread_name_prefix='kunna-stats')
+        self.last_collection = {}
+        self.container_metrics = {}  # id -> últimas métricas leídas
+        self.stats_inflight = {}  # id -> lectura de stats que no terminó a tiempo
+        self.last_system_metrics = {}
+        psutil.cpu_percent(interval=None)  # primera lectura de referencia para cpu_percent
+        # Inventario: id corto -> info básica (lo actualiza el hilo de eventos)
+        self.inventory = {}
+        self.inventory_lock = threading.Lock()
+        self.inventory_changed = asyncio.Event()
+        self.loop = None
+        self.control_tasks = set()  # comandos de control en curso (referencia para que no se recolecten)
+        # Protocolo de deltas: secuencia y último estado enviado en esta conexión
+        self.seq = 0
+        self.sent_containers = None  # id -> contenedor (None = próximo envío es snapshot)
+        self.sent_metrics = {}
+        self.central_capabilities = set()
         self.setup_static_routes()
         
     def setup_static_routes(self):
@@ -100,84 +136,235 @@ class KunnaAgent:
             self.log(f"❌ Error conectando a Docker: {e}", "ERROR")
             return False
     
+    def container_info(self, container):
+        """Info básica de un contenedor (sin métricas) a partir de sus attrs"""
+        attrs = container.attrs
+        info = {
+            "id": container.short_id,
+            "name": container.name,
+            # Imagen con la que se creó (evita un lookup de la imagen por contenedor)
+            "image": attrs['Config'].get('Image') or "unknown",
+            "status": container.status,
+            "state": attrs['State']['Status'],
+        }
+        health = attrs['State'].get('Health')
+        if health:
+            info['health'] = health.get('Status')
+        
+        # Puertos
+        ports = []
+        port_bindings = attrs['NetworkSettings'].get('Ports') or {}
+        for container_port, host_bindings in port_bindings.items():
+            if host_bindings:
+                # Puerto expuesto al host
+                for binding in host_bindings:
+                    ports.append(f"{binding['HostPort']}:{container_port}")
+            else:
+                # Puerto interno sin binding al host (ej: servicios detrás de proxy)
+                # Extraer solo el número de puerto (ej: "5678/tcp" -> "5678")
+                internal_port = container_port.split('/')[0]
+                ports.append(f"internal:{internal_port}")
+        info['ports'] = ports
+        
+        # Networks
+        info['networks'] = list((attrs['NetworkSettings'].get('Networks') or {}).keys())
+        
+        # Labels
+        labels = container.labels
+        info['app_group'] = labels.get('kunna.app', 
+                                      labels.get('com.docker.compose.project', 'uncategorized'))
+        return info
+    
+    def sync_inventory(self):
+        """Reconstruye el inventario completo (al arrancar y como red de seguridad periódica)"""
+        inventory = {}
+        for container in self.docker_client.containers.list(all=True):
+            try:
+                inventory[container.short_id] = self.container_info(container)
+            except Exception as e:
+                self.log(f"Error leyendo contenedor {container.name}: {e}", "ERROR")
+        with self.inventory_lock:
+            changed = inventory != self.inventory
+            self.inventory = inventory
+        if changed:
+            self.notify_inventory_changed()
+    
+    def apply_docker_event(self, event):
+        """Actualiza el inventario con un evento de contenedor de Docker"""
+        action = event.get('Action') or event.get('status') or ''
+        if action not in INVENTORY_EVENTS and not action.startswith('health_status'):
+            return
+        container_id = (event.get('id') or event.get('Actor', {}).get('ID') or '')[:12]
+        if not container_id:
+            return
+        
+        info = None
+        if action != 'destroy':
+            try:
+                info = self.container_info(self.docker_client.containers.get(container_id))
+            except docker.errors.NotFound:
+                pass
+        
+        with self.inventory_lock:
+            current = self.inventory.get(container_id)
+            if info is None:
+                changed = self.inventory.pop(container_id, None) is not None
+            else:
+                changed = current != info
+                self.inventory[container_id] = info
+        if changed:
+            self.log(f"🐳 {action}: {info['name'] if info else container_id}")
+            self.notify_inventory_changed()
+    
+    def watch_events(self, since):
+        """Hilo: aplica el stream de eventos de Docker; cada INVENTORY_RESYNC segundos
+        (o tras un error) el stream se corta y se resincroniza el inventario completo"""
+        while True:
+            until = since + INVENTORY_RESYNC
+            try:
+                for event in self.docker_client.events(since=int(since), until=int(until) + 1,
+                                                       decode=True, filters={'type': 'container'}):
+                    self.apply_docker_event(event)
+            except Exception as e:
+                self.log(f"Error en eventos de Docker: {e}", "ERROR")
+                time.sleep(5)
+            # Los eventos desde since se vuelven a pedir: la resincronización no deja huecos
+            since = time.time()
+            try:
+                self.sync_inventory()
+            except Exception as e:
+                self.log(f"Error resincronizando inventario: {e}", "ERROR")
+    
+    def notify_inventory_changed(self):
+        """Despierta al heartbeat para enviar el cambio sin esperar al intervalo"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.inventory_changed.set)
+    
+    async def wait_inventory_change(self, timeout):
+        """True si el inventario cambió antes de timeout segundos"""
+        try:
+            await asyncio.wait_for(self.inventory_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        # Agrupar ráfagas de eventos (docker compose up/down) en un solo envío
+        await asyncio.sleep(INVENTORY_DEBOUNCE)
+        self.inventory_changed.clear()
+        return True
+    
+    def sample_metrics(self):
+        """Lee stats de los contenedores en marcha y métricas del sistema (bloqueante: corre en un hilo)"""
+        started = time.monotonic()
+        with self.inventory_lock:
+            running = [container_id for container_id, info in self.inventory.items() if info['status'] == 'running']
+        
+        # Lecturas que no terminaron a tiempo en muestreos anteriores
+        for container_id in set(self.stats_inflight) - set(running):
+            self.stats_inflight.pop(container_id).cancel()
+        metrics = {}
+        pending = {}
+        skipped = 0
+        for container_id in running:
+            future = self.stats_inflight.get(container_id)
+            if future is not None and not future.done():
+                # Sigue en curso: no se encola otra lectura del mismo contenedor
+                skipped += 1
+                continue
+            if future is not None:
+                # Terminó tarde: su resultado vale hasta que llegue el nuevo
+                del self.stats_inflight[container_id]
+                if not future.cancelled():
+                    metrics[container_id] = future.result()
+            pending[self.stats_pool.submit(self.get_container_metrics, container_id)] = container_id
+        
+        done, not_done = wait(pending, timeout=STATS_TIMEOUT)
+        for future in done:
+            metrics[pending[future]] = future.result()
+        for future in not_done:
+            # Las que aún esperan en la cola se cancelan; las que ya corren quedan en curso
+            if not future.cancel():
+                self.stats_inflight[pending[future]] = future
+        
+        # Sin lectura nueva: últimas métricas conocidas marcadas como viejas (o None)
+        stale = 0
+        for container_id in running:
+            if container_id not in metrics:
+                previous = self.container_metrics.get(container_id)
+                metrics[container_id] = dict(previous, stale=True) if previous else None
+                stale += 1
+        if not_done or skipped:
+            self.log(f"⏱️  Stats sin respuesta en {STATS_TIMEOUT}s: {len(not_done)} contenedores "
+                     f"({skipped} con lectura anterior aún en curso)", "WARNING")
+        system_metrics = self.get_system_metrics()
+        
+        # Se publican reemplazando las referencias: el event loop nunca ve un estado a medias
+        self.container_metrics = metrics
+        self.last_system_metrics = system_metrics
+        self.last_collection = {
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+            "stats_containers": len(running),
+            "stats_timeouts": len(not_done),
+            "stats_skipped": skipped,
+            "stats_stale": stale,
+            "concurrency": STATS_CONCURRENCY,
+        }
+    
+    async def sampler(self):
+        """Tarea de fondo: muestrea cada HEARTBEAT_INTERVAL sin bloquear el event loop"""
+        first = True
+        while True:
+            started = time.monotonic()
+            try:
+                await asyncio.to_thread(self.sample_metrics)
+                if first:
+                    # Enviar ya las primeras métricas en lugar de esperar al próximo heartbeat
+                    self.inventory_changed.set()
+                    first = False
+            except Exception as e:
+                self.log(f"Error muestreando métricas: {e}", "ERROR")
+            await asyncio.sleep(max(0, HEARTBEAT_INTERVAL - (time.monotonic() - started)))
+    
     def get_containers(self):
-        """Obtiene lista de contenedores con métricas"""
+        """Contenedores del inventario con las últimas métricas muestreadas (no bloquea)"""
         if not self.docker_client:
             return []
         
-        containers = []
-        try:
-            for container in self.docker_client.containers.list(all=True):
-                # Info básica
-                info = {
-                    "id": container.short_id,
-                    "name": container.name,
-                    "image": container.image.tags[0] if container.image.tags else "unknown",
-                    "status": container.status,
-                    "state": container.attrs['State']['Status'],
-                }
-                
-                # Puertos
-                ports = []
-                port_bindings = container.attrs['NetworkSettings'].get('Ports', {})
-                for container_port, host_bindings in port_bindings.items():
-                    if host_bindings:
-                        # Puerto expuesto al host
-                        for binding in host_bindings:
-                            ports.append(f"{binding['HostPort']}:{container_port}")
-                    else:
-                        # Puerto interno sin binding al host (ej: servicios detrás de proxy)
-                        # Extraer solo el número de puerto (ej: "5678/tcp" -> "5678")
-                        internal_port = container_port.split('/')[0]
-                        ports.append(f"internal:{internal_port}")
-                info['ports'] = ports
-                
-                # Networks
-                info['networks'] = list(container.attrs['NetworkSettings']['Networks'].keys())
-                
-                # Labels
-                labels = container.labels
-                info['app_group'] = labels.get('kunna.app', 
-                                              labels.get('com.docker.compose.project', 'uncategorized'))
-                
-                # Métricas (solo si está corriendo)
-                if container.status == 'running':
-                    try:
-                        stats = container.stats(stream=False)
-                        # CPU
-                        cpu_delta = stats['cpu_stats']['cpu_usage']['total_usage'] - \
-                                   stats['precpu_stats']['cpu_usage']['total_usage']
-                        system_delta = stats['cpu_stats']['system_cpu_usage'] - \
-                                      stats['precpu_stats']['system_cpu_usage']
-                        cpu_percent = (cpu_delta / system_delta) * 100.0 if system_delta > 0 else 0.0
-                        
-                        # Memoria
-                        mem_usage = stats['memory_stats']['usage']
-                        mem_limit = stats['memory_stats']['limit']
-                        mem_percent = (mem_usage / mem_limit) * 100.0
-                        
-                        info['metrics'] = {
-                            'cpu_percent': round(cpu_percent, 2),
-                            'memory_usage': mem_usage,
-                            'memory_percent': round(mem_percent, 2)
-                        }
-                    except:
-                        info['metrics'] = None
-                else:
-                    info['metrics'] = None
-                
-                containers.append(info)
-                
-        except Exception as e:
-            self.log(f"Error obteniendo contenedores: {e}", "ERROR")
-        
+        with self.inventory_lock:
+            containers = [dict(info) for info in self.inventory.values()]
+        metrics = self.container_metrics
+        for info in containers:
+            info['metrics'] = metrics.get(info['id']) if info['status'] == 'running' else None
         return containers
     
+    def get_container_metrics(self, container_id):
+        """CPU y memoria de un contenedor (bloquea ~1-2s mientras Docker muestrea)"""
+        try:
+            stats = self.docker_client.api.stats(container_id, stream=False)
+            # CPU
+            cpu_delta = stats['cpu_stats']['cpu_usage']['total_usage'] - \
+                       stats['precpu_stats']['cpu_usage']['total_usage']
+            system_delta = stats['cpu_stats']['system_cpu_usage'] - \
+                          stats['precpu_stats']['system_cpu_usage']
+            cpu_percent = (cpu_delta / system_delta) * 100.0 if system_delta > 0 else 0.0
+            
+            # Memoria
+            mem_usage = stats['memory_stats']['usage']
+            mem_limit = stats['memory_stats']['limit']
+            mem_percent = (mem_usage / mem_limit) * 100.0
+            
+            return {
+                'cpu_percent': round(cpu_percent, 2),
+                'memory_usage': mem_usage,
+                'memory_percent': round(mem_percent, 2)
+            }
+        except:
+            return None
+    
     def get_system_metrics(self):
         """Obtiene métricas del sistema"""
         try:
             return {
-                "cpu_percent": psutil.cpu_percent(interval=1),
+                # Uso desde la llamada anterior (el muestreo anterior): no espera
+                "cpu_percent": psutil.cpu_percent(interval=None),
                 "memory_percent": psutil.virtual_memory().percent,
                 "disk_percent": psutil.disk_usage('/').percent,
                 "uptime": int(time.time() - psutil.boot_time())
@@ -186,21 +373,75 @@ class KunnaAgent:
             return {}
     
     def build_payload(self):
-        """Construye el payload completo para enviar"""
+        """Construye el payload completo con el último muestreo publicado (no bloquea)"""
+        containers = self.get_containers()
         return {
             "type": "agent_data",
             "server_info": self.server_info,
-            "containers": self.get_containers(),
-            "metrics": self.get_system_metrics(),
+            "containers": containers,
+            "metrics": self.last_system_metrics,
+            "collection": self.last_collection,
             "timestamp": datetime.now().isoformat()
         }
+    
+    def build_message(self):
+        """Snapshot completo (agent_data) o, si el central lo soporta, solo los cambios (agent_delta)"""
+        payload = self.build_payload()
+        self.seq += 1
+        payload['seq'] = self.seq
+        containers = {container['id']: container for container in payload['containers']}
+        
+        use_delta = HEARTBEAT_MODE == 'delta' and 'delta' in self.central_capabilities
+        if use_delta and self.sent_containers is not None:
+            message = self.diff_payload(payload, containers)
+        else:
+            message = payload
+        self.sent_containers = containers
+        self.sent_metrics = payload['metrics']
+        return message
+    
+    def diff_payload(self, payload, containers):
+        """Delta contra el último estado enviado: contenedores nuevos, eliminados,
+        campos modificados por contenedor y métricas del sistema que cambiaron o desaparecieron"""
+        previous = self.sent_containers
+        changed = []
+        for container_id, container in containers.items():
+            old = previous.get(container_id)
+            if old is None or old == container:
+                continue
+            patch = {
+                "id": container_id,
+                "set": {key: value for key, value in container.items() if key not in old or old[key] != value},
+            }
+            unset = [key for key in old if key not in container]
+            if unset:
+                patch['unset'] = unset
+            changed.append(patch)
+        
+        return {
+            "type": "agent_delta",
+            "seq": payload['seq'],
+            "added": [container for container_id, container in containers.items() if container_id not in previous],
+            "removed": [container_id for container_id in previous if container_id not in containers],
+            "changed": changed,
+            "metrics": {key: value for key, value in payload['metrics'].items() if self.sent_metrics.get(key) != value},
+            "metrics_unset": [key for key in self.sent_metrics if key not in payload['metrics']],
+            "collection": payload['collection'],
+            "timestamp": payload['timestamp']
+        }
+    
     async def send_heartbeat(self, websocket):
-        """Envía datos periódicamente al servidor central"""
+        """Envía datos al servidor central cada HEARTBEAT_INTERVAL o en cuanto cambia el inventario"""
         while True:
             try:
-                payload = self.build_payload()
-                await websocket.send(json.dumps(payload))
-                self.log(f"📊 Datos enviados: {len(payload['containers'])} contenedores")
+                message = self.build_message()
+                await websocket.send(json.dumps(message))
+                if message['type'] == 'agent_delta':
+                    self.log(f"📊 Delta #{message['seq']} enviado: +{len(message['added'])} "
+                             f"-{len(message['removed'])} ~{len(message['changed'])} contenedores")
+                else:
+                    self.log(f"📊 Datos enviados: {len(message['containers'])} contenedores "
+                             f"(recolección {message['collection'].get('duration_ms')} ms)")
                 
                 # Enviar eventos de tráfico buffereados
                 if self.traffic_buffer:
@@ -217,7 +458,8 @@ class KunnaAgent:
                     
                     self.log(f"📡 Enviados {len(traffic_events)} eventos de tráfico")
                 
-                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                # Un cambio de inventario se envía ya, con las últimas métricas
+                await self.wait_inventory_change(HEARTBEAT_INTERVAL)
             except Exception as e:
                 self.log(f"Error enviando heartbeat: {e}", "ERROR")
                 raise
@@ -239,11 +481,20 @@ class KunnaAgent:
                     
                     self.log(f"🎮 Comando recibido: {action} en {container_id}")
                     
-                    response = await self.handle_container_control(action, container_id)
-                    response['type'] = 'container_control_response'
-                    if request_id:
-                        response['request_id'] = request_id
-                    await websocket.send(json.dumps(response))
+                    # En una tarea aparte: un stop lento no frena la recepción de otros comandos
+                    task = asyncio.create_task(self.reply_container_control(websocket, action, container_id, request_id))
+                    self.control_tasks.add(task)
+                    task.add_done_callback(self.control_tasks.discard)
+                    
+                elif msg_type == 'registration_confirmed':
+                    self.central_capabilities = set(data.get('capabilities') or [])
+                    self.log(f"🤝 Registro confirmado (capacidades: {', '.join(sorted(self.central_capabilities)) or 'ninguna'})")
+                    
+                elif msg_type == 'resync_request':
+                    # El central perdió la secuencia: el próximo envío es un snapshot, ya mismo
+                    self.log("🔁 El central pidió un snapshot completo", "WARNING")
+                    self.sent_containers = None
+                    self.inventory_changed.set()
                     
                 else:
                     self.log(f"⚠️  Tipo de mensaje desconocido: {msg_type}", "WARNING")
@@ -252,8 +503,23 @@ class KunnaAgent:
                 self.log(f"Error recibiendo comandos: {e}", "ERROR")
                 raise
     
+    async def reply_container_control(self, websocket, action: str, container_id: str, request_id=None):
+        """Ejecuta un comando de control y envía la respuesta al central"""
+        response = await self.handle_container_control(action, container_id)
+        response['type'] = 'container_control_response'
+        if request_id:
+            response['request_id'] = request_id
+        try:
+            await websocket.send(json.dumps(response))
+        except Exception as e:
+            self.log(f"Error enviando respuesta de control: {e}", "ERROR")
+    
     async def handle_container_control(self, action: str, container_id: str):
-        """Maneja comandos de control de contenedores"""
+        """Maneja comandos de control de contenedores (las llamadas a Docker corren en un hilo)"""
+        return await asyncio.to_thread(self.container_control, action, container_id)
+    
+    def container_control(self, action: str, container_id: str):
+        """Ejecuta start/stop/restart sobre un contenedor (bloqueante)"""
         try:
             container = self.docker_client.containers.get(container_id)
             
@@ -377,8 +643,17 @@ class KunnaAgent:
             self.log("❌ No se pudo conectar a Docker, saliendo...", "ERROR")
             sys.exit(1)
         
-        # Iniciar API de tráfico y WebSocket en paralelo
+        # Inventario inicial y después solo eventos de Docker (+ resincronización periódica)
+        self.loop = asyncio.get_running_loop()
+        since = time.time()
+        await asyncio.to_thread(self.sync_inventory)
+        self.log(f"🐳 Inventario inicial: {len(self.inventory)} contenedores")
+        threading.Thread(target=self.watch_events, args=(since,), daemon=True).start()
+        
+        # Iniciar muestreo, API de tráfico y WebSocket en paralelo; nada de esto
+        # bloquea el event loop (Docker y psutil corren en hilos)
         await asyncio.gather(
+            self.sampler(),
             self.start_traffic_api(),
             self.send_data()
         )
@@ -394,6 +669,9 @@ class KunnaAgent:
                     extra_headers={"Authorization": f"Bearer {AGENT_TOKEN}"}
                 ) as websocket:
                     self.websocket = websocket
+                    # Conexión nueva: empezar con un snapshot y esperar las capacidades del central
+                    self.sent_containers = None
+                    self.central_capabilities = set()
                     self.log(f"✅ Conectado al central: {CENTRAL_URL}")
                     
                     # Enviar registro inicial
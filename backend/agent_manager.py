@@ -3,13 +3,27 @@ Agent Manager - Gestión de agentes remotos
 Maneja conexiones, registro y datos de agentes
 """
 
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 import asyncio
 from fastapi import WebSocket
 import json
 import uuid
 
+# Campo de cada contenedor que cambia en cada heartbeat (stats de Docker)
+VOLATILE_CONTAINER_FIELDS = ('metrics',)
+
+
+def same_except_metrics(a: dict, b: dict) -> bool:
+    """Contenedores iguales salvo por sus métricas"""
+    if a.keys() != b.keys():
+        return False
+    return all(a[key] == b[key] for key in a if key not in VOLATILE_CONTAINER_FIELDS)
+
+
+def _same_inventory(a: List[dict], b: List[dict]) -> bool:
+    return len(a) == len(b) and all(same_except_metrics(x, y) for x, y in zip(a, b))
+
 class RemoteServer:
     """Representa un servidor remoto registrado"""
     def __init__(self, server_id: str, hostname: str, ip: str):
@@ -22,6 +36,11 @@ class RemoteServer:
         self.last_heartbeat = None
         self.containers = []
         self.metrics = {}
+        # Duración de la última recolección del agente (contenedores + stats)
+        self.collection = {}
+        # Protocolo de deltas: secuencia del último mensaje aplicado y si hay un resync pedido
+        self.seq: Optional[int] = None
+        self.resync_pending = False
         self.websocket: Optional[WebSocket] = None
         self.registered_at = datetime.now()
         
@@ -36,6 +55,7 @@ class RemoteServer:
             "last_heartbeat": self.last_heartbeat.isoformat() if self.last_heartbeat else None,
             "containers_count": len(self.containers),
             "metrics": self.metrics,
+            "collection": self.collection,
             "registered_at": self.registered_at.isoformat()
         }
 
@@ -49,6 +69,26 @@ class AgentManager:
         self._pending_requests: Dict[str, asyncio.Future] = {}
         # request_id -> server_id (para cancelar en disconnect)
         self._pending_request_server: Dict[str, str] = {}
+        # Callbacks (event, server) para 'connected', 'updated' y 'disconnected'
+        self._listeners: List[Callable[[str, RemoteServer], None]] = []
+        # Contadores monótonos para ETags:
+        # - version: cualquier cambio de estado (conexiones, heartbeats, métricas)
+        # - containers_version: solo cambios en la lista de contenedores (métricas incluidas)
+        # - inventory_version: cambios en los contenedores salvo sus métricas
+        self.version = 0
+        self.containers_version = 0
+        self.inventory_version = 0
+
+    def add_listener(self, listener: Callable[[str, RemoteServer], None]):
+        """Registra un callback para cambios de estado de los agentes"""
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, server: RemoteServer):
+        for listener in self._listeners:
+            try:
+                listener(event, server)
+            except Exception as e:
+                print(f"Error en listener de agentes ({event}): {e}")
         
     async def register_agent(self, server_info: dict, websocket: WebSocket) -> RemoteServer:
         """Registra un nuevo agente"""
@@ -58,6 +98,9 @@ class AgentManager:
             server = self.servers[server_id]
             server.connected = True
             server.websocket = websocket
+            # Conexión nueva: los deltas empiezan tras su primer snapshot
+            server.seq = None
+            server.resync_pending = False
         else:
             server = RemoteServer(
                 server_id=server_id,
@@ -71,7 +114,9 @@ class AgentManager:
             self.servers[server_id] = server
         
         self.active_connections[server_id] = websocket
+        self.version += 1
         print(f"✅ Agente registrado: {server.hostname} ({server.ip})")
+        self._notify('connected', server)
         
         return server
     
@@ -89,7 +134,9 @@ class AgentManager:
         if server_id in self.servers:
             self.servers[server_id].connected = False
             self.servers[server_id].websocket = None
+            self.version += 1
             print(f"🔌 Agente desconectado: {server_id}")
+            self._notify('disconnected', self.servers[server_id])
         
         if server_id in self.active_connections:
             del self.active_connections[server_id]
@@ -100,16 +147,90 @@ class AgentManager:
             return
         
         server = self.servers[server_id]
-        server.containers = data.get('containers', [])
+        containers = data.get('containers', [])
+        if containers != server.containers:
+            self.containers_version += 1
+            if not _same_inventory(containers, server.containers):
+                self.inventory_version += 1
+        server.containers = containers
         server.metrics = data.get('metrics', {})
+        server.collection = data.get('collection', {})
         server.last_heartbeat = datetime.now()
+        # Un snapshot completo (re)inicia la secuencia de deltas
+        server.seq = data.get('seq')
+        server.resync_pending = False
+        self.version += 1
         
         # Actualizar info del servidor si viene
         if 'server_info' in data:
             info = data['server_info']
             server.os = info.get('os', server.os)
             server.docker_version = info.get('docker_version', server.docker_version)
+
+        self._notify('updated', server)
     
+    def apply_agent_delta(self, server_id: str, data: dict) -> bool:
+        """Aplica un delta de heartbeat (agent_delta) sobre el último estado del agente.
+
+        Devuelve False si falta el snapshot base o hay un hueco en la secuencia:
+        el delta no se aplica y hay que pedir un snapshot al agente.
+        """
+        server = self.servers.get(server_id)
+        if server is None:
+            return False
+        seq = data.get('seq')
+        if server.seq is None or server.resync_pending or seq != server.seq + 1:
+            return False
+        server.seq = seq
+
+        added = data.get('added') or []
+        removed = set(data.get('removed') or [])
+        changed = {patch.get('id'): patch for patch in data.get('changed') or []}
+        if added or removed or changed:
+            # Lista nueva (los consumidores detectan cambios por identidad); los
+            # contenedores sin cambios conservan el mismo dict
+            containers = []
+            for container in server.containers:
+                container_id = container.get('id')
+                if container_id in removed:
+                    continue
+                patch = changed.get(container_id)
+                if patch is not None:
+                    container = {**container, **patch.get('set', {})}
+                    for key in patch.get('unset', ()):
+                        container.pop(key, None)
+                containers.append(container)
+            containers.extend(added)
+            server.containers = containers
+            self.containers_version += 1
+            # Un parche que solo toca métricas no cambia el inventario
+            if added or removed or any(
+                key not in VOLATILE_CONTAINER_FIELDS
+                for patch in changed.values()
+                for key in (*patch.get('set', {}), *patch.get('unset', ()))
+            ):
+                self.inventory_version += 1
+
+        if data.get('metrics') or data.get('metrics_unset'):
+            metrics = {**server.metrics, **(data.get('metrics') or {})}
+            for key in data.get('metrics_unset') or ():
+                metrics.pop(key, None)
+            server.metrics = metrics
+        if 'collection' in data:
+            server.collection = data['collection']
+        server.last_heartbeat = datetime.now()
+        self.version += 1
+        self._notify('updated', server)
+        return True
+
+    def request_resync(self, server_id: str) -> bool:
+        """Marca que se pidió un snapshot; False si ya había uno pendiente"""
+        server = self.servers.get(server_id)
+        if server is None or server.resync_pending:
+            return False
+        server.resync_pending = True
+        return True
+
     def get_server(self, server_id: str) -> Optional[RemoteServer]:
         """Obtiene un servidor por ID"""
         return self.servers.get(server_id)
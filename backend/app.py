@@ -1,20 +1,35 @@
-from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, HttpUrl
-from typing import List, Optional
+from typing import List, Optional, Union
 import json
 import os
 from datetime import datetime
 import time
 import asyncio
+import base64
 import docker
 import psutil
 import socket
+import uuid
+import zlib
 
 # Import agent manager and ssh deployer
 from agent_manager import agent_manager
 from ssh_deployer import deployer
+from service_store import ServiceValidationError, create_service_store
+from remote_services import remote_services
+from fast_json import FastJSONResponse, dumps as json_dumps, loads as json_loads
+from connection_manager import ConnectionManager, TrafficFrame
+from traffic import TrafficPipeline, normalize_batch, normalize_event
+from traffic_stats import TrafficStats, WINDOWS as TRAFFIC_STATS_WINDOWS
+from traffic_history import TrafficHistory
+from traffic_log import TrafficLog
+from traffic_edges import TrafficEdgeStore
+from traffic_anomalies import AnomalyDetector
+from traffic_top import TrafficTop, TOP_METRICS
+from topology import TopologyModel, TopologyStream, DefaultTopologyView, UnifiedTopologyView, TOPOLOGY_FORMATS
 
 # Docker client for local container control
 try:
@@ -35,28 +50,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # El frontend (otro origen) necesita leer el ETag para enviar If-None-Match
+    expose_headers=["ETag"],
 )
 
 # WebSocket manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# Cola de salida por cliente de /ws/traffic (mayor que un lote del pipeline) y política para clientes lentos
+TRAFFIC_WS_QUEUE_SIZE = int(os.getenv("KUNNA_TRAFFIC_WS_QUEUE_SIZE", "10000"))
+TRAFFIC_WS_SLOW_POLICY = os.getenv("KUNNA_TRAFFIC_WS_SLOW_POLICY", "drop_oldest")
+# Keepalive de /ws/traffic: ping cada N segundos, se retira el cliente tras N segundos sin respuesta
+TRAFFIC_WS_PING_INTERVAL = float(os.getenv("KUNNA_TRAFFIC_WS_PING_INTERVAL", "20"))
+TRAFFIC_WS_PING_TIMEOUT = float(os.getenv("KUNNA_TRAFFIC_WS_PING_TIMEOUT", "60"))
+# Agrupar el tráfico en un frame cada N ms (0 = un mensaje por evento) con hasta N muestras completas
+TRAFFIC_FRAME_MS = float(os.getenv("KUNNA_TRAFFIC_FRAME_MS", "100"))
+TRAFFIC_FRAME_SAMPLES = int(os.getenv("KUNNA_TRAFFIC_FRAME_SAMPLES", "200"))
+# La reproducción siempre va en frames, aunque el tráfico en vivo sea un mensaje por evento
+TRAFFIC_REPLAY_FRAME_MS = TRAFFIC_FRAME_MS or 100
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
-
-manager = ConnectionManager()
+manager = ConnectionManager(
+    queue_size=TRAFFIC_WS_QUEUE_SIZE,
+    policy=TRAFFIC_WS_SLOW_POLICY,
+    ping_interval=TRAFFIC_WS_PING_INTERVAL,
+    ping_timeout=TRAFFIC_WS_PING_TIMEOUT,
+    frame_interval=TRAFFIC_FRAME_MS / 1000,
+    frame_samples=TRAFFIC_FRAME_SAMPLES,
+)
 
 # Middleware para capturar requests
 @app.middleware("http")
@@ -80,13 +98,54 @@ async def track_requests(request: Request, call_next):
             "timestamp": datetime.now().isoformat()
         }
         
-        # Broadcast a clientes WebSocket
-        if manager.active_connections:
-            asyncio.create_task(manager.broadcast(event))
+        # Encolar para el pipeline de tráfico (broadcast a clientes WebSocket)
+        traffic_pipeline.submit([event])
     
     return response
 
-DATA_FILE = "/app/data/services.json"
+DATA_FILE = os.getenv("KUNNA_DATA_FILE", "/app/data/services.json")
+# Backend de almacenamiento de servicios: "journal" (services.json) o "sqlite"
+SERVICE_STORE_BACKEND = os.getenv("KUNNA_SERVICE_STORE", "journal")
+SQLITE_FILE = os.getenv("KUNNA_SQLITE_FILE", "/app/data/services.db")
+# Compactar el journal cada N operaciones o cada N segundos (lo que ocurra primero)
+JOURNAL_COMPACT_OPS = int(os.getenv("KUNNA_JOURNAL_COMPACT_OPS", "1000"))
+JOURNAL_COMPACT_INTERVAL = int(os.getenv("KUNNA_JOURNAL_COMPACT_INTERVAL", "60"))
+# Eventos de tráfico encolados como máximo antes de descartar (backpressure)
+TRAFFIC_QUEUE_SIZE = int(os.getenv("KUNNA_TRAFFIC_QUEUE_SIZE", "100000"))
+# Eventos por lote en el endpoint NDJSON
+TRAFFIC_NDJSON_BATCH = int(os.getenv("KUNNA_TRAFFIC_NDJSON_BATCH", "1000"))
+# Máximo de aristas y de (to, path) con estadísticas (se descartan las menos recientes)
+TRAFFIC_STATS_MAX_KEYS = int(os.getenv("KUNNA_TRAFFIC_STATS_MAX_KEYS", "10000"))
+# Memoria total del historial de tráfico (eventos crudos + rollups 10s/1m/1h)
+TRAFFIC_HISTORY_MB = float(os.getenv("KUNNA_TRAFFIC_HISTORY_MB", "64"))
+# Puntos máximos por consulta de /api/traffic/history
+TRAFFIC_HISTORY_MAX_POINTS = 10000
+# Log persistente de tráfico en segmentos (retención por tamaño total y antigüedad)
+TRAFFIC_LOG_ENABLED = os.getenv("KUNNA_TRAFFIC_LOG", "true").lower() in ("1", "true", "yes")
+TRAFFIC_LOG_DIR = os.getenv("KUNNA_TRAFFIC_LOG_DIR", "/app/data/traffic")
+TRAFFIC_LOG_SEGMENT_MB = float(os.getenv("KUNNA_TRAFFIC_LOG_SEGMENT_MB", "16"))
+TRAFFIC_LOG_SEGMENT_SECONDS = float(os.getenv("KUNNA_TRAFFIC_LOG_SEGMENT_SECONDS", "3600"))
+TRAFFIC_LOG_MAX_MB = float(os.getenv("KUNNA_TRAFFIC_LOG_MAX_MB", "1024"))
+TRAFFIC_LOG_RETENTION_HOURS = float(os.getenv("KUNNA_TRAFFIC_LOG_RETENTION_HOURS", "72"))
+# Aristas de la topología inferidas del tráfico: expiran tras N segundos sin
+# tráfico, se acotan a un máximo y se publican en la topología cada N segundos
+TRAFFIC_EDGE_IDLE = float(os.getenv("KUNNA_TRAFFIC_EDGE_IDLE", "300"))
+TRAFFIC_EDGE_MAX = int(os.getenv("KUNNA_TRAFFIC_EDGE_MAX", "5000"))
+TRAFFIC_EDGE_WINDOW = int(os.getenv("KUNNA_TRAFFIC_EDGE_WINDOW", "60"))
+TRAFFIC_EDGE_REFRESH = float(os.getenv("KUNNA_TRAFFIC_EDGE_REFRESH", "10"))
+# Heavy hitters (Space-Saving): contadores por servicio destino y de toda la
+# flota, y máximo de destinos seguidos (se descartan los menos recientes)
+TRAFFIC_TOP_CAPACITY = int(os.getenv("KUNNA_TRAFFIC_TOP_CAPACITY", "100"))
+TRAFFIC_TOP_FLEET_CAPACITY = int(os.getenv("KUNNA_TRAFFIC_TOP_FLEET_CAPACITY", "1000"))
+TRAFFIC_TOP_MAX_TARGETS = int(os.getenv("KUNNA_TRAFFIC_TOP_MAX_TARGETS", "1000"))
+# Detección de anomalías por arista: umbral del z-score, factores de la línea
+# base (lenta) y de la media reciente (rápida), y eventos mínimos antes de alertar
+TRAFFIC_ANOMALY_Z = float(os.getenv("KUNNA_TRAFFIC_ANOMALY_Z", "4"))
+TRAFFIC_ANOMALY_ALPHA = float(os.getenv("KUNNA_TRAFFIC_ANOMALY_ALPHA", "0.01"))
+TRAFFIC_ANOMALY_FAST_ALPHA = float(os.getenv("KUNNA_TRAFFIC_ANOMALY_FAST_ALPHA", "0.1"))
+TRAFFIC_ANOMALY_WARMUP = int(os.getenv("KUNNA_TRAFFIC_ANOMALY_WARMUP", "100"))
+# Velocidad máxima de replay (múltiplo del tiempo real)
+TRAFFIC_REPLAY_MAX_SPEED = 1000
 
 class TrafficEvent(BaseModel):
     """Modelo para eventos de tráfico entre servicios"""
@@ -98,6 +157,25 @@ class TrafficEvent(BaseModel):
     duration: Optional[float] = None  # en milisegundos
     timestamp: Optional[str] = None
 
+class ContainerSnapshot(BaseModel):
+    """Contenedor tal como lo ve el docker-monitor en un escaneo"""
+    id: str
+    name: str
+    image: Optional[str] = "unknown"
+    status: str
+    port: Optional[int] = None
+    app_group: Optional[str] = "uncategorized"
+    networks: List[str] = []
+    # Presentación sugerida por el monitor (solo se usa al crear)
+    icon: Optional[str] = None
+    category: Optional[str] = None
+    color: Optional[str] = None
+
+class ServiceSyncRequest(BaseModel):
+    """Snapshot completo de contenedores de un host (server_id=None para el host local)"""
+    server_id: Optional[str] = None
+    containers: List[ContainerSnapshot]
+
 class Service(BaseModel):
     id: Optional[str] = None
     name: str
@@ -116,23 +194,180 @@ class Service(BaseModel):
     server_id: Optional[str] = None
     server_hostname: Optional[str] = None
 
+class ServicePage(BaseModel):
+    """Respuesta paginada de GET /api/services (con limit o cursor)"""
+    items: List[Service]
+    count: int
+    next_cursor: Optional[str] = None
+
+# Store cargado al arrancar (journal: crea services.json vacío si no existe;
+# sqlite: migra services.json la primera vez)
+service_store = create_service_store(
+    SERVICE_STORE_BACKEND,
+    data_file=DATA_FILE,
+    sqlite_file=SQLITE_FILE,
+    compact_every=JOURNAL_COMPACT_OPS,
+)
+
+# Conversiones contenedor remoto -> servicio memoizadas por heartbeat
+# (compartidas por /api/services y las dos topologías)
+agent_manager.add_listener(remote_services.apply_agent_event)
+
+# Topologías mantenidas en memoria: se actualizan con cada mutación del store
+# y con cada heartbeat / conexión de agentes
+topology = TopologyModel(DefaultTopologyView(), remote_services)
+unified_topology = TopologyModel(UnifiedTopologyView(), remote_services)
+
+for _model in (topology, unified_topology):
+    _model.sync_local(service_store.all())
+    service_store.add_listener(lambda changes, m=_model: m.apply_store_changes(changes, service_store))
+    agent_manager.add_listener(_model.apply_agent_event)
+
+# Deltas de la topología SCADA para /ws/topology
+topology_stream = TopologyStream(topology)
+
+# Versión monótona del store local (se combina con la de los agentes en los ETags)
+services_version = 0
+
+def _bump_services_version(changes):
+    global services_version
+    services_version += 1
+
+service_store.add_listener(_bump_services_version)
+
+# Identificador de arranque: evita reutilizar ETags de un proceso anterior
+BOOT_ID = uuid.uuid4().hex[:8]
+
+def make_etag(request: Request, *versions) -> str:
+    """ETag fuerte a partir de versiones de estado + query string (los filtros cambian la respuesta)"""
+    query = zlib.crc32(str(request.query_params).encode('utf-8'))
+    return '"' + "-".join([BOOT_ID, *(str(v) for v in versions), f"{query:x}"]) + '"'
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Devuelve una respuesta 304 si el cliente ya tiene esta versión"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+
 def load_services():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+    return service_store.all()
 
 def save_services(services):
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(services, f, indent=2, ensure_ascii=False)
+    service_store.replace_all(services)
 
-def initialize_default_services():
-    if not os.path.exists(DATA_FILE):
-        # Inicializar con lista vacía - los servicios se agregarán automáticamente por el monitor
-        save_services([])
+async def _journal_compaction_loop():
+    """Mantenimiento periódico del store (compactación / checkpoint WAL) fuera del camino de las requests"""
+    while True:
+        await asyncio.sleep(JOURNAL_COMPACT_INTERVAL)
+        try:
+            await asyncio.to_thread(service_store.compact_if_dirty)
+        except Exception as e:
+            print(f"Error compactando journal de servicios: {e}")
 
-initialize_default_services()
+# Ingesta de tráfico: los endpoints encolan y la tarea del pipeline entrega a los sinks
+traffic_pipeline = TrafficPipeline(max_pending=TRAFFIC_QUEUE_SIZE)
+
+def _broadcast_traffic(events):
+    manager.publish_traffic(events)
+
+traffic_pipeline.add_sink(_broadcast_traffic)
+
+# Estadísticas por arista / (to, path) en ventanas 1m/5m/1h
+traffic_stats = TrafficStats(max_keys=TRAFFIC_STATS_MAX_KEYS)
+traffic_pipeline.add_sink(traffic_stats.record)
+
+# Historial columnar en memoria (requiere NumPy)
+try:
+    traffic_history = TrafficHistory(max_bytes=int(TRAFFIC_HISTORY_MB * 1024 * 1024))
+    traffic_pipeline.add_sink(traffic_history.record)
+except RuntimeError as e:
+    print(f"⚠️  Warning: Historial de tráfico deshabilitado: {e}")
+    traffic_history = None
+
+# Dependencias observadas en el tráfico, publicadas periódicamente en las topologías
+traffic_edges = TrafficEdgeStore(
+    max_edges=TRAFFIC_EDGE_MAX,
+    idle_seconds=TRAFFIC_EDGE_IDLE,
+    window_seconds=TRAFFIC_EDGE_WINDOW,
+)
+traffic_pipeline.add_sink(traffic_edges.record)
+
+async def _traffic_edges_loop():
+    """Expira las aristas inactivas y publica las métricas en las topologías"""
+    while True:
+        await asyncio.sleep(TRAFFIC_EDGE_REFRESH)
+        try:
+            traffic_edges.expire()
+            edges = traffic_edges.edges()
+            for model in (topology, unified_topology):
+                model.set_traffic_edges(edges)
+        except Exception as e:
+            print(f"Error publicando aristas de tráfico: {e}")
+
+# Endpoints más calientes por destino y de la flota con memoria fija
+traffic_top = TrafficTop(
+    capacity=TRAFFIC_TOP_CAPACITY,
+    fleet_capacity=TRAFFIC_TOP_FLEET_CAPACITY,
+    max_targets=TRAFFIC_TOP_MAX_TARGETS,
+)
+traffic_pipeline.add_sink(traffic_top.record)
+
+# Anomalías de latencia / errores por arista, emitidas en /ws/traffic
+anomaly_detector = AnomalyDetector(
+    threshold=TRAFFIC_ANOMALY_Z,
+    alpha=TRAFFIC_ANOMALY_ALPHA,
+    fast_alpha=TRAFFIC_ANOMALY_FAST_ALPHA,
+    warmup=TRAFFIC_ANOMALY_WARMUP,
+    max_edges=TRAFFIC_STATS_MAX_KEYS,
+)
+
+def _detect_anomalies(events):
+    for change in anomaly_detector.record(events):
+        manager.publish(change)
+
+traffic_pipeline.add_sink(_detect_anomalies)
+
+# Log de tráfico en disco para replay
+traffic_log = None
+if TRAFFIC_LOG_ENABLED:
+    try:
+        traffic_log = TrafficLog(
+            TRAFFIC_LOG_DIR,
+            segment_bytes=int(TRAFFIC_LOG_SEGMENT_MB * 1024 * 1024),
+            segment_seconds=TRAFFIC_LOG_SEGMENT_SECONDS,
+            max_bytes=int(TRAFFIC_LOG_MAX_MB * 1024 * 1024),
+            max_age=TRAFFIC_LOG_RETENTION_HOURS * 3600,
+        )
+        traffic_pipeline.add_sink(traffic_log.record)
+    except OSError as e:
+        print(f"⚠️  Warning: Log de tráfico deshabilitado: {e}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    topology_stream.attach_loop(asyncio.get_running_loop())
+    asyncio.create_task(_journal_compaction_loop())
+    asyncio.create_task(_traffic_edges_loop())
+    traffic_pipeline.start()
+    manager.start()
+
+@app.on_event("shutdown")
+async def stop_traffic_pipeline():
+    await traffic_pipeline.stop()
+    await manager.stop()
+    if traffic_log is not None:
+        traffic_log.close()
+
+@app.on_event("shutdown")
+def flush_service_store():
+    service_store.close()
 
 @app.get("/")
 def read_root():
@@ -181,95 +416,241 @@ def get_system_ips():
         
     return {"ips": ips}
 
-@app.get("/api/services", response_model=List[Service])
-def get_services(category: Optional[str] = None, active: Optional[bool] = None):
-    # Servicios locales del archivo JSON
-    services = load_services()
+# ============= PAGINACIÓN Y FILTROS =============
+
+SERVICE_FIELDS = set(Service.__fields__)
+MAX_PAGE_SIZE = int(os.getenv("KUNNA_MAX_PAGE_SIZE", "1000"))
+# Revalidar cada item con el response_model (lento con miles de servicios; útil para depurar)
+VALIDATE_RESPONSES = os.getenv("KUNNA_VALIDATE_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+# Valores por defecto del modelo Service, en el orden de sus campos (obligatorios -> None)
+SERVICE_DEFAULTS = {
+    field: (None if field in ("name", "description", "url") else value)
+    for field, value in Service(name="", description="", url="").dict().items()
+}
+
+def service_record(service: dict) -> dict:
+    """Registro con la misma forma que produce response_model=Service, sin validar con pydantic.
+
+    Los servicios del store ya se validaron al escribirse y los remotos los
+    construye el backend, así que basta con completar los valores por defecto.
+    """
+    return {field: service.get(field, default) for field, default in SERVICE_DEFAULTS.items()}
+
+def fast_response(content, response: Response) -> FastJSONResponse:
+    """Respuesta serializada con FastJSONResponse conservando las cabeceras (ETag)"""
+    return FastJSONResponse(content, headers=dict(response.headers))
+
+def encode_cursor(key: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(key, list):
+            raise ValueError("cursor must encode a list")
+        return key
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str], allowed: set) -> Optional[List[str]]:
+    """Lista de campos pedidos en ?fields=a,b,c (400 si alguno no existe)"""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+def project(item: dict, fields: Optional[List[str]]) -> dict:
+    if fields is None:
+        return item
+    return {field: item.get(field) for field in fields}
+
+def paginate(items: list, sort_key, limit: Optional[int], cursor: Optional[str]):
+    """Página de items ordenados por sort_key a partir del cursor; devuelve (página, next_cursor)"""
+    items.sort(key=sort_key)
+    if cursor:
+        after = decode_cursor(cursor)
+        items = [item for item in items if sort_key(item) > after]
+    if limit is None or len(items) <= limit:
+        return items, None
+    page = items[:limit]
+    return page, encode_cursor(sort_key(page[-1]))
+
+def service_sort_key(service: dict) -> list:
+    # Locales primero (por id numérico), luego remotos por id
+    service_id = str(service.get('id'))
+    if service.get('is_remote'):
+        return [1, 1, 0, service_id]
+    if service_id.isdigit():
+        return [0, 0, int(service_id), service_id]
+    return [0, 1, 0, service_id]
+
+def container_sort_key(container: dict) -> list:
+    return [str(container.get('server_id')), str(container.get('id'))]
+
+def filter_remote_containers(containers, server_id=None, app_group=None, status=None,
+                             active=None, name_prefix=None):
+    """Filtra contenedores remotos antes de convertirlos (mismos campos que el servicio resultante)"""
+    result = []
+    for container in containers:
+        if server_id is not None and container['server_id'] != server_id:
+            continue
+        if status is not None and container['status'] != status:
+            continue
+        if active is not None and (container['status'] == 'running') != active:
+            continue
+        if app_group is not None and f"{container['server_hostname']}-{container.get('app_group', 'unknown')}" != app_group:
+            continue
+        if name_prefix and not str(container.get('name', '')).startswith(name_prefix):
+            continue
+        result.append(container)
+    return result
+
+def remote_container_to_service(container: dict) -> dict:
+    """Convierte un contenedor remoto al formato de servicio"""
+    # Extraer puertos expuestos (formato: "HostPort:ContainerPort" o "internal:Port")
+    ports = container.get('ports', [])
     
-    # Agregar servicios remotos de los agentes
-    remote_containers = agent_manager.get_all_containers()
-    for container in remote_containers:
-        # Extraer puertos expuestos (formato: "HostPort:ContainerPort" o "internal:Port")
-        ports = container.get('ports', [])
-        
-        # Priorizar puertos HTTP comunes (80, 443, 8080, 8443, 3000, 5000, 5678)
-        http_ports = ['80', '443', '8080', '8443', '3000', '5000', '5678']
-        selected_port = None
-        is_internal = False
-        
-        if ports:
-            # Buscar puerto HTTP común (primero externos, luego internos)
-            for port_mapping in ports:
-                if port_mapping.startswith('internal:'):
-                    # Puerto interno
-                    internal_port = port_mapping.split(':')[1]
-                    if internal_port in http_ports and not selected_port:
-                        selected_port = internal_port
-                        is_internal = True
-                else:
-                    # Puerto expuesto al host
-                    host_port = port_mapping.split(':')[0]
-                    if host_port in http_ports:
-                        selected_port = host_port
-                        is_internal = False
-                        break
-            
-            # Si no hay puerto HTTP común, usar el primero disponible
-            if not selected_port:
-                first_port = ports[0]
-                if first_port.startswith('internal:'):
-                    selected_port = first_port.split(':')[1]
+    # Priorizar puertos HTTP comunes (80, 443, 8080, 8443, 3000, 5000, 5678)
+    http_ports = ['80', '443', '8080', '8443', '3000', '5000', '5678']
+    selected_port = None
+    is_internal = False
+    
+    if ports:
+        # Buscar puerto HTTP común (primero externos, luego internos)
+        for port_mapping in ports:
+            if port_mapping.startswith('internal:'):
+                # Puerto interno
+                internal_port = port_mapping.split(':')[1]
+                if internal_port in http_ports and not selected_port:
+                    selected_port = internal_port
                     is_internal = True
-                else:
-                    selected_port = first_port.split(':')[0]
+            else:
+                # Puerto expuesto al host
+                host_port = port_mapping.split(':')[0]
+                if host_port in http_ports:
+                    selected_port = host_port
                     is_internal = False
+                    break
         
-        # Construir URL usando la IP real del servidor (server_id) y el puerto expuesto
-        if selected_port and not is_internal:
-            url = f"http://{container['server_id']}:{selected_port}"
-            description = f"Remote: {container['image']} on {container['server_hostname']}"
-        elif selected_port and is_internal:
-            # Puerto interno - probablemente detrás de proxy
-            url = "#"
-            description = f"🔒 Internal: {container['image']} on {container['server_hostname']} (port {selected_port} via proxy)"
-        else:
-            # Sin puerto expuesto - servicio interno
-            url = "#"
-            description = f"🔒 Internal: {container['image']} on {container['server_hostname']} (no exposed ports)"
-        
-        # Convertir contenedor remoto a formato de servicio
-        remote_service = {
-            "id": f"remote-{container['server_id']}-{container['id']}",
-            "name": container['name'],
-            "description": description,
-            "url": url,
-            "icon": "🌐",
-            "category": "Remote Services",
-            "color": "#9333ea",
-            "isActive": container['status'] == 'running',
-            "status": container['status'],
-            "container_id": f"remote-{container['server_id']}-{container['id']}",
-            "app_group": f"{container['server_hostname']}-{container.get('app_group', 'unknown')}",
-            "networks": container.get('networks', []),
-            "is_remote": True,
-            "server_id": container['server_id'],
-            "server_hostname": container['server_hostname'],
-            "createdAt": None
-        }
-        services.append(remote_service)
-    
-    if category:
-        services = [s for s in services if s.get("category") == category]
+        # Si no hay puerto HTTP común, usar el primero disponible
+        if not selected_port:
+            first_port = ports[0]
+            if first_port.startswith('internal:'):
+                selected_port = first_port.split(':')[1]
+                is_internal = True
+            else:
+                selected_port = first_port.split(':')[0]
+                is_internal = False
     
-    if active is not None:
-        services = [s for s in services if s.get("isActive") == active]
+    # Construir URL usando la IP real del servidor (server_id) y el puerto expuesto
+    if selected_port and not is_internal:
+        url = f"http://{container['server_id']}:{selected_port}"
+        description = f"Remote: {container['image']} on {container['server_hostname']}"
+    elif selected_port and is_internal:
+        # Puerto interno - probablemente detrás de proxy
+        url = "#"
+        description = f"🔒 Internal: {container['image']} on {container['server_hostname']} (port {selected_port} via proxy)"
+    else:
+        # Sin puerto expuesto - servicio interno
+        url = "#"
+        description = f"🔒 Internal: {container['image']} on {container['server_hostname']} (no exposed ports)"
     
-    return services
+    return {
+        "id": f"remote-{container['server_id']}-{container['id']}",
+        "name": container['name'],
+        "description": description,
+        "url": url,
+        "icon": "🌐",
+        "category": "Remote Services",
+        "color": "#9333ea",
+        "isActive": container['status'] == 'running',
+        "status": container['status'],
+        "container_id": f"remote-{container['server_id']}-{container['id']}",
+        "app_group": f"{container['server_hostname']}-{container.get('app_group', 'unknown')}",
+        "networks": container.get('networks', []),
+        "is_remote": True,
+        "server_id": container['server_id'],
+        "server_hostname": container['server_hostname'],
+        "createdAt": None
+    }
+
+# El servicio convertido se guarda ya normalizado: no se vuelve a procesar por request
+remote_services.register("api", lambda container: service_record(remote_container_to_service(container)))
+
+@app.get("/api/services", response_model=Union[List[Service], ServicePage])
+def get_services(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    active: Optional[bool] = None,
+    server_id: Optional[str] = None,
+    app_group: Optional[str] = None,
+    status: Optional[str] = None,
+    is_remote: Optional[bool] = None,
+    name_prefix: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+):
+    """Lista de servicios; con limit o cursor, una página {items, count, next_cursor}.
+
+    Con fields, cada servicio trae solo los campos pedidos (más id).
+    """
+    # Leer versiones antes de construir la respuesta (un cambio concurrente solo invalida antes)
+    etag = make_etag(request, "svc", services_version, agent_manager.inventory_version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
+
+    selected_fields = parse_fields(fields, SERVICE_FIELDS)
+    if selected_fields is not None and 'id' not in selected_fields:
+        selected_fields.insert(0, 'id')
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    # Servicios locales: filtrados por los índices del store
+    services = []
+    if is_remote is not True:
+        filters = {
+            field: value for field, value in (
+                ("category", category), ("isActive", active), ("server_id", server_id),
+                ("app_group", app_group), ("status", status),
+            ) if value is not None
+        }
+        services = service_store.query(filters, name_prefix=name_prefix)
+        if is_remote is False:
+            services = [s for s in services if not s.get('is_remote')]
+
+    # Servicios remotos de los agentes: filtrar contenedores antes de convertirlos
+    if is_remote is not False and category in (None, "Remote Services"):
+        containers = filter_remote_containers(
+            remote_services.containers(agent_manager.get_all_servers()),
+            server_id=server_id, app_group=app_group, status=status,
+            active=active, name_prefix=name_prefix,
+        )
+        services.extend(remote_services.convert("api", container) for container in containers)
+
+    if limit is None and cursor is None:
+        if selected_fields is None and VALIDATE_RESPONSES:
+            return services
+        return fast_response([project(service_record(s), selected_fields) for s in services], response)
+
+    page, next_cursor = paginate(services, service_sort_key, limit, cursor)
+    return fast_response({
+        "items": [project(service_record(s), selected_fields) for s in page],
+        "count": len(page),
+        "next_cursor": next_cursor,
+    }, response)
 
 @app.get("/api/services/{service_id}", response_model=Service)
 def get_service(service_id: str):
-    services = load_services()
-    service = next((s for s in services if s["id"] == service_id), None)
+    service = service_store.get(service_id)
     
     if not service:
         raise HTTPException(status_code=404, detail="Servicio no encontrado")
@@ -278,151 +659,169 @@ def get_service(service_id: str):
 
 @app.post("/api/services", response_model=Service)
 def create_service(service: Service):
-    services = load_services()
-    
     # Verificar si ya existe un servicio con el mismo nombre (evitar duplicados del docker-monitor)
-    existing = next((s for s in services if s.get("name") == service.name), None)
+    existing = service_store.get_by_name(service.name)
     if existing:
         # Si ya existe, actualizarlo en lugar de crear uno nuevo
         service.id = existing["id"]
         service.createdAt = existing.get("createdAt", datetime.now().isoformat())
         
-        index = next((i for i, s in enumerate(services) if s["id"] == existing["id"]), None)
-        services[index] = service.dict()
-        save_services(services)
+        service_store.put(service.dict())
         return service
     
     # Si no existe, crear nuevo con ID incremental
-    new_id = str(max([int(s["id"]) for s in services if s["id"].isdigit()] + [0]) + 1)
-    service.id = new_id
+    service.id = service_store.next_id()
     service.createdAt = datetime.now().isoformat()
     
-    services.append(service.dict())
-    save_services(services)
+    service_store.put(service.dict())
     
     return service
 
+@app.post("/api/services/sync")
+def sync_services(snapshot: ServiceSyncRequest):
+    """Aplica en una sola transacción el diff entre el snapshot de un host y los servicios registrados.
+
+    - Contenedores nuevos y corriendo: se crean
+    - Contenedores registrados: se sincroniza status/isActive y se completan metadatos faltantes
+    - Servicios con container_id del host que ya no existen en Docker: se eliminan
+    """
+    created, updated, deleted = [], [], []
+    unchanged = 0
+
+    with service_store.locked():
+        puts = []
+        next_id = int(service_store.next_id())
+        now = datetime.now().isoformat()
+
+        for container in snapshot.containers:
+            existing = service_store.get_by_name(container.name)
+
+            if existing:
+                changes = {}
+
+                # Mantener status/isActive sincronizados
+                if existing.get('status') != container.status:
+                    changes['status'] = container.status
+                    changes['isActive'] = container.status == 'running'
+
+                # Asegurar container_id (clave para habilitar start/stop en UI)
+                if not existing.get('container_id') and container.id:
+                    changes['container_id'] = container.id
+
+                # Completar metadatos si faltan
+                if not existing.get('app_group') and container.app_group:
+                    changes['app_group'] = container.app_group
+                if not existing.get('networks') and container.networks:
+                    changes['networks'] = container.networks
+
+                # Completar URL si es desconocida y hay puerto
+                if (not existing.get('url') or existing.get('url') == '#') and container.port:
+                    changes['url'] = f"http://localhost:{container.port}"
+
+                if changes:
+                    puts.append({**existing, **changes})
+                    updated.append({"id": existing["id"], "name": container.name, "fields": sorted(changes)})
+                else:
+                    unchanged += 1
+                continue
+
+            # Solo registrar contenedores corriendo
+            if container.status != 'running':
+                continue
+
+            service = Service(
+                id=str(next_id),
+                name=container.name,
+                description=f"Contenedor Docker: {container.image}",
+                url=f"http://localhost:{container.port}" if container.port else '#',
+                icon=container.icon or '🐳',
+                category=container.category or 'Docker Services',
+                color=container.color or '#2496ed',
+                isActive=True,
+                status=container.status,
+                container_id=container.id,
+                app_group=container.app_group,
+                networks=container.networks,
+                createdAt=now,
+                server_id=snapshot.server_id,
+            )
+            next_id += 1
+            puts.append(service.dict())
+            created.append({"id": service.id, "name": service.name})
+
+        # Servicios del host (no remotos, con container_id) que ya no existen en Docker
+        container_names = {c.name for c in snapshot.containers}
+        deletes = []
+        for existing in service_store.all():
+            if existing.get('is_remote') or not existing.get('container_id'):
+                continue
+            if existing.get('server_id') != snapshot.server_id:
+                continue
+            if existing.get('name') not in container_names:
+                deletes.append(existing['id'])
+                deleted.append({"id": existing["id"], "name": existing.get("name")})
+
+        service_store.apply(puts, deletes)
+
+    return {
+        "created": created,
+        "updated": updated,
+        "deleted": deleted,
+        "unchanged": unchanged,
+    }
+
 @app.put("/api/services/{service_id}", response_model=Service)
 def update_service(service_id: str, service: Service):
-    services = load_services()
+    existing = service_store.get(service_id)
     
-    index = next((i for i, s in enumerate(services) if s["id"] == service_id), None)
-    
-    if index is None:
+    if existing is None:
         raise HTTPException(status_code=404, detail="Servicio no encontrado")
     
     service.id = service_id
     if not service.createdAt:
-        service.createdAt = services[index].get("createdAt", datetime.now().isoformat())
+        service.createdAt = existing.get("createdAt", datetime.now().isoformat())
     
-    services[index] = service.dict()
-    save_services(services)
+    service_store.put(service.dict())
     
     return service
 
 @app.delete("/api/services/{service_id}")
 def delete_service(service_id: str):
-    services = load_services()
-    
-    services = [s for s in services if s["id"] != service_id]
-    save_services(services)
+    service_store.delete(service_id)
     
     return {"message": "Servicio eliminado correctamente"}
 
 @app.get("/api/categories")
 def get_categories():
-    services = load_services()
-    categories = list(set(s.get("category", "general") for s in services))
-    return {"categories": sorted(categories)}
+    return {"categories": service_store.categories()}
+
+def _check_topology_format(fmt: str):
+    if fmt not in TOPOLOGY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido: {fmt} (usar {', '.join(TOPOLOGY_FORMATS)})")
 
 @app.get("/api/topology")
-def get_topology():
-    """Obtiene la topología de servicios para visualización SCADA (incluye locales + remotos)"""
-    # Servicios locales
-    local_services = load_services()
-    
-    # Servicios remotos
-    remote_containers = agent_manager.get_all_containers()
-    
-    # Combinar todos los servicios
-    all_services = local_services.copy()
-    
-    # Convertir contenedores remotos a formato servicio
-    for container in remote_containers:
-        all_services.append({
-            "id": f"remote-{container['server_id']}-{container['id']}",
-            "name": container["name"],
-            "status": container.get("status", "unknown"),
-            "isActive": container.get("status") == "running",
-            "icon": "🌐",
-            "networks": container.get("networks", []),
-            "app_group": f"remote-{container['server_hostname']}",
-            "is_remote": True,
-            "server_id": container['server_id'],
-            "server_hostname": container['server_hostname'],
-            "container_id": f"remote-{container['server_id']}-{container['id']}"
-        })
-    
-    # Agrupar por app_group
-    groups = {}
-    connections = []
-    
-    for service in all_services:
-        app_group = service.get("app_group", "uncategorized")
-        
-        if app_group not in groups:
-            groups[app_group] = {
-                "id": app_group,
-                "name": app_group,
-                "services": []
-            }
-        
-        groups[app_group]["services"].append({
-            "id": service["id"],
-            "name": service["name"],
-            "status": service.get("status", "unknown"),
-            "isActive": service.get("isActive", True),
-            "icon": service.get("icon", "🔗"),
-            "networks": service.get("networks", []),
-            "is_remote": service.get("is_remote", False),
-            "server_hostname": service.get("server_hostname"),
-            "container_id": service.get("container_id")
-        })
-    
-    # Detectar conexiones entre servicios (por redes compartidas)
-    network_map = {}
-    for service in all_services:
-        for network in service.get("networks", []):
-            if network not in network_map:
-                network_map[network] = []
-            network_map[network].append(service["id"])
-    
-    # Crear conexiones entre servicios en la misma red
-    for network, service_ids in network_map.items():
-        if len(service_ids) > 1:
-            for i, source in enumerate(service_ids):
-                for target in service_ids[i+1:]:
-                    connections.append({
-                        "source": source,
-                        "target": target,
-                        "network": network
-                    })
-    
-    return {
-        "groups": list(groups.values()),
-        "connections": connections,
-        "total_services": len(all_services),
-        "active_services": len([s for s in all_services if s.get("isActive", True)])
-    }
+def get_topology(request: Request, fmt: str = Query("pairs", alias="format")):
+    """Obtiene la topología de servicios para visualización SCADA (incluye locales + remotos)
+
+    - format=pairs (por defecto): una conexión por par de servicios en la misma red
+    - format=hub: cada red como hub con su lista de miembros y contadores (tamaño lineal)
+    """
+    _check_topology_format(fmt)
+    return _topology_response(request, topology, fmt)
+
+def _topology_response(request: Request, model: TopologyModel, fmt: str) -> Response:
+    etag = make_etag(request, "topo", model.version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    response = Response(content=model.snapshot_json(fmt), media_type="application/json")
+    set_etag(response, etag)
+    return response
 
 @app.patch("/api/services/{service_id}")
 def patch_service(service_id: str, updates: dict):
     """Actualiza parcialmente un servicio (para estados)"""
-    services = load_services()
-    
-    index = next((i for i, s in enumerate(services) if s["id"] == service_id), None)
-    
-    if index is None:
+    if service_store.get(service_id) is None:
         raise HTTPException(status_code=404, detail="Servicio no encontrado")
     
     allowed_fields = {
@@ -442,39 +841,189 @@ def patch_service(service_id: str, updates: dict):
     }
 
     # Actualizar solo los campos permitidos (y permitir agregar nuevos campos conocidos)
-    for key, value in updates.items():
-        if key in allowed_fields:
-            services[index][key] = value
-    
-    save_services(services)
+    changes = {key: value for key, value in updates.items() if key in allowed_fields}
+    try:
+        service = service_store.patch(service_id, changes)
+    except ServiceValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if service is None:
+        raise HTTPException(status_code=404, detail="Servicio no encontrado")
     
-    return services[index]
+    return service
 
 @app.post("/api/traffic")
 async def report_traffic(event: TrafficEvent):
     """Endpoint para que servicios externos reporten tráfico al SCADA"""
-    # Completar timestamp si no viene
-    if not event.timestamp:
-        event.timestamp = datetime.now().isoformat()
-    
-    # Crear evento en formato compatible con WebSocket
-    traffic_event = {
-        "type": "request",
-        "from": event.from_service,
-        "to": event.to_service,
-        "method": event.method,
-        "path": event.path or "/",
-        "status": event.status or 200,
-        "duration": event.duration or 0,
-        "timestamp": event.timestamp
-    }
-    
-    # Broadcast a clientes SCADA
-    if manager.active_connections:
-        await manager.broadcast(traffic_event)
+    # Crear evento en formato compatible con WebSocket y encolarlo (sin esperar el broadcast)
+    traffic_pipeline.submit([normalize_event(event.dict())])
     
     return {"status": "ok", "broadcasted_to": len(manager.active_connections)}
 
+@app.post("/api/traffic/batch")
+async def report_traffic_batch(request: Request):
+    """Reporta un array JSON de eventos de tráfico en un solo request
+
+    Los eventos inválidos se cuentan como rechazados sin invalidar el resto del lote.
+    """
+    try:
+        raw_events = json_loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(raw_events, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of traffic events")
+
+    events, rejected = normalize_batch(raw_events)
+    return traffic_pipeline.submit(events, rejected)
+
+@app.post("/api/traffic/stream")
+async def report_traffic_stream(request: Request):
+    """Reporta eventos de tráfico en NDJSON (un evento por línea)
+
+    Los eventos se validan y encolan por lotes a medida que llega el cuerpo.
+    """
+    totals = {"accepted": 0, "rejected": 0, "dropped": 0}
+    pending_lines: List[bytes] = []
+    buffer = b""
+
+    def flush():
+        raw_events, invalid = [], 0
+        for line in pending_lines:
+            try:
+                raw_events.append(json_loads(line))
+            except ValueError:
+                invalid += 1
+        pending_lines.clear()
+        events, rejected = normalize_batch(raw_events)
+        for key, value in traffic_pipeline.submit(events, rejected + invalid).items():
+            totals[key] += value
+
+    async for chunk in request.stream():
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        pending_lines.extend(line for line in lines if line.strip())
+        if len(pending_lines) >= TRAFFIC_NDJSON_BATCH:
+            flush()
+
+    if buffer.strip():
+        pending_lines.append(buffer)
+    flush()
+    return totals
+
+@app.get("/api/traffic/stats")
+def get_traffic_stats(
+    window: str = "5m",
+    by: str = "edge",
+    from_service: Optional[str] = Query(None, alias="from"),
+    to_service: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(100, ge=1, le=10000),
+):
+    """Conteos, tasa de errores (5xx) y percentiles de latencia por arista o por (to, path)"""
+    if window not in TRAFFIC_STATS_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Invalid window. Use one of: {', '.join(TRAFFIC_STATS_WINDOWS)}")
+    if by not in ("edge", "path"):
+        raise HTTPException(status_code=400, detail="Invalid by. Use edge or path")
+    return traffic_stats.query(window=window, by=by, source=from_service, target=to_service, limit=limit)
+
+@app.get("/api/traffic/top")
+def get_traffic_top(
+    by: str = "count",
+    to_service: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(20, ge=1, le=1000),
+):
+    """Endpoints (method, path) más calientes de un servicio destino o de toda la flota (aproximado)"""
+    if by not in TOP_METRICS:
+        raise HTTPException(status_code=400, detail=f"Invalid by. Use one of: {', '.join(TOP_METRICS)}")
+    return traffic_top.query(by=by, target=to_service, limit=limit)
+
+@app.get("/api/traffic/anomalies")
+def get_traffic_anomalies(
+    limit: int = Query(100, ge=1, le=1000),
+    since: Optional[str] = None,
+):
+    """Anomalías abiertas y las últimas detectadas (más recientes primero)"""
+    return {
+        "active": anomaly_detector.active(),
+        "recent": anomaly_detector.history(limit=limit, since=parse_time(since, None)),
+        **anomaly_detector.stats(),
+    }
+
+def parse_time(value: Optional[str], default: float) -> float:
+    """Epoch en segundos o fecha ISO 8601"""
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid time: {value}")
+
+@app.get("/api/traffic/history")
+def get_traffic_history(
+    from_time: Optional[str] = Query(None, alias="from"),
+    to_time: Optional[str] = Query(None, alias="to"),
+    step: float = Query(60, gt=0),
+    source: Optional[str] = None,
+    target: Optional[str] = None,
+):
+    """Serie temporal del tráfico entre from y to (por defecto la última hora) cada step segundos"""
+    if traffic_history is None:
+        raise HTTPException(status_code=503, detail="Traffic history requires NumPy")
+    end = parse_time(to_time, time.time())
+    start = parse_time(from_time, end - 3600)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if (end - start) / step > TRAFFIC_HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Too many points; use a larger step (max {TRAFFIC_HISTORY_MAX_POINTS})")
+    return fast_response(traffic_history.query(start, end, step, source=source, target=target), Response())
+
+def _replay_range(from_time: Optional[str], to_time: Optional[str]):
+    if traffic_log is None:
+        raise HTTPException(status_code=503, detail="Traffic log is disabled")
+    end = parse_time(to_time, time.time())
+    start = parse_time(from_time, end - 3600)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    return start, end
+
+@app.get("/api/traffic/replay")
+async def replay_traffic(
+    from_time: Optional[str] = Query(None, alias="from"),
+    to_time: Optional[str] = Query(None, alias="to"),
+    speed: Optional[float] = Query(None, gt=0, le=TRAFFIC_REPLAY_MAX_SPEED),
+):
+    """Eventos del log de tráfico entre from y to como NDJSON.
+
+    Sin speed se exportan tan rápido como se leen; con speed se emiten al
+    ritmo original multiplicado por speed.
+    """
+    start, end = _replay_range(from_time, to_time)
+
+    async def lines():
+        if speed is None:
+            batches = traffic_log.reader(start, end)
+            try:
+                while True:
+                    batch = await asyncio.to_thread(batches.next_batch)
+                    if batch is None:
+                        break
+                    yield b"".join(json_dumps(event) + b"\n" for _, event in batch)
+            finally:
+                batches.close()
+        else:
+            async for _, events in traffic_log.replay(start, end, speed, TRAFFIC_REPLAY_FRAME_MS):
+                yield b"".join(json_dumps(event) + b"\n" for event in events)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/api/traffic/clients")
+def get_traffic_clients():
+    """Clientes de /ws/traffic con su cola pendiente, lag, mensajes descartados y conexiones retiradas"""
+    return manager.stats()
+
 # ============= CONTROL DE CONTENEDORES =============
 
 @app.post("/api/containers/{container_id}/start")
@@ -659,14 +1208,62 @@ async def restart_container(container_id: str):
 
 @app.websocket("/ws/traffic")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket para transmitir eventos de tráfico en tiempo real"""
-    await manager.connect(websocket)
+    """WebSocket para transmitir eventos de tráfico en tiempo real
+
+    El servidor envía {"type": "ping"} periódicamente; el cliente debe responder
+    {"type": "pong"} (o cualquier mensaje) antes del timeout.
+    """
+    await manager.serve(websocket)
+
+@app.websocket("/ws/traffic/replay")
+async def replay_websocket(websocket: WebSocket):
+    """Replay del log de tráfico para la vista SCADA
+
+    Query params `from`, `to` (epoch o ISO 8601, por defecto la última hora) y
+    `speed` (múltiplo del tiempo real, por defecto 1). Envía frames como
+    /ws/traffic, con `replay_time` (hora original del frame), y al terminar
+    {"type": "replay_end"}.
+    """
+    await websocket.accept()
+    params = websocket.query_params
     try:
-        while True:
-            # Mantener conexión abierta
-            await websocket.receive_text()
+        start, end = _replay_range(params.get("from"), params.get("to"))
+        speed = float(params.get("speed", "1"))
+        if not 0 < speed <= TRAFFIC_REPLAY_MAX_SPEED:
+            raise ValueError(f"speed must be in (0, {TRAFFIC_REPLAY_MAX_SPEED}]")
+    except (HTTPException, ValueError) as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        await websocket.send_json({"type": "error", "detail": detail})
+        await websocket.close()
+        return
+
+    total = 0
+    try:
+        async for log_time, events in traffic_log.replay(start, end, speed, TRAFFIC_REPLAY_FRAME_MS):
+            frame = TrafficFrame(TRAFFIC_FRAME_SAMPLES)
+            for event in events:
+                frame.add(event)
+            total += frame.total
+            await websocket.send_json({**frame.message(TRAFFIC_REPLAY_FRAME_MS), "replay_time": log_time})
+        await websocket.send_json({"type": "replay_end", "from": start, "to": end, "total": total})
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
+@app.websocket("/ws/topology")
+async def topology_websocket(websocket: WebSocket):
+    """WebSocket de topología: snapshot inicial + deltas (altas/bajas, estado, redes, agentes)
+
+    Query param `format` (pairs|hub) elige el formato del snapshot.
+    El cliente puede enviar {"type": "resync"} para pedir un snapshot nuevo.
+    """
+    fmt = websocket.query_params.get("format", "pairs")
+    if fmt not in TOPOLOGY_FORMATS:
+        fmt = "pairs"
+    try:
+        await topology_stream.serve(websocket, fmt)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
 
 # ============= ENDPOINTS PARA AGENTES REMOTOS =============
 
@@ -690,39 +1287,26 @@ async def agent_websocket(websocket: WebSocket):
                 server = await agent_manager.register_agent(server_info, websocket)
                 server_id = server.id
                 
-                # Confirmar registro
-            
-            elif msg_type == 'traffic_event':
-                # Evento de tráfico desde agente remoto
-                event = data.get('event', {})
-                print(f"🚦 Traffic event recibido: {event.get('from_service')} → {event.get('to_service')}")
-                
-                # Reenviar al WebSocket de tráfico con metadata del servidor
-                traffic_msg = {
-                    "type": "request",
-                    "from": event.get('from_service'),
-                    "to": event.get('to_service'),
-                    "method": event.get('method', 'HTTP'),
-                    "path": event.get('path', '/'),
-                    "status": event.get('status', 200),
-                    "duration": event.get('duration', 0),
-                    "timestamp": event.get('timestamp'),
-                    "server_id": event.get('server_id'),
-                    "server_hostname": event.get('server_hostname'),
-                    "is_remote": True
-                }
-                
-                # Broadcast a clientes SCADA
-                if manager.active_connections:
-                    print(f"📡 Broadcasting a {len(manager.active_connections)} clientes SCADA")
-                    await manager.broadcast(traffic_msg)
-                else:
-                    print("⚠️  No hay clientes SCADA conectados")
+                # Confirmar registro (con las capacidades del protocolo que entiende el central)
                 await websocket.send_json({
                     "type": "registration_confirmed",
                     "server_id": server_id,
-                    "message": "Agente registrado correctamente"
+                    "message": "Agente registrado correctamente",
+                    "capabilities": ["delta"]
                 })
+            
+            elif msg_type == 'traffic_event':
+                # Evento de tráfico desde agente remoto: misma validación que /api/traffic
+                event = data.get('event', {})
+                events, rejected = normalize_batch([event])
+                for traffic_msg in events:
+                    # Metadata del servidor de origen
+                    traffic_msg["server_id"] = event.get('server_id')
+                    traffic_msg["server_hostname"] = event.get('server_hostname')
+                    traffic_msg["is_remote"] = True
+                
+                # Encolar para los clientes SCADA (sin esperar los envíos)
+                traffic_pipeline.submit(events, rejected)
                 
             elif msg_type == 'agent_data':
                 # Actualización de datos
@@ -735,6 +1319,12 @@ async def agent_websocket(websocket: WebSocket):
                     if server_id:
                         agent_manager.update_agent_data(server_id, data)
 
+            elif msg_type == 'agent_delta':
+                # Heartbeat incremental: si no encaja en la secuencia, pedir un snapshot
+                if server_id and not agent_manager.apply_agent_delta(server_id, data):
+                    if agent_manager.request_resync(server_id):
+                        await websocket.send_json({"type": "resync_request", "server_id": server_id})
+
             elif msg_type == 'container_control_response':
                 # Respuesta a un comando previo (start/stop/restart)
                 agent_manager.handle_agent_response(data)
@@ -748,8 +1338,14 @@ async def agent_websocket(websocket: WebSocket):
             agent_manager.disconnect_agent(server_id)
 
 @app.get("/api/remote/servers")
-def get_remote_servers():
+def get_remote_servers(request: Request, response: Response):
     """Obtiene lista de servidores remotos"""
+    etag = make_etag(request, "servers", agent_manager.version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
+
     servers = agent_manager.get_all_servers()
     return {
         "total": len(servers),
@@ -767,17 +1363,61 @@ def get_remote_server(server_id: str):
     return server.to_dict()
 
 @app.get("/api/remote/containers")
-def get_remote_containers():
+def get_remote_containers(
+    request: Request,
+    response: Response,
+    server_id: Optional[str] = None,
+    app_group: Optional[str] = None,
+    status: Optional[str] = None,
+    active: Optional[bool] = None,
+    name_prefix: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+):
     """Obtiene todos los contenedores de servidores remotos"""
-    containers = agent_manager.get_all_containers()
-    return {
-        "total": len(containers),
-        "containers": containers
+    etag = make_etag(request, "containers", agent_manager.containers_version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
+
+    containers = filter_remote_containers(
+        remote_services.containers(agent_manager.get_all_servers()),
+        server_id=server_id, app_group=app_group, status=status,
+        active=active, name_prefix=name_prefix,
+    )
+    # Los contenedores no tienen esquema fijo: cualquier campo es proyectable
+    selected_fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    if selected_fields is not None:
+        for key in ('server_id', 'id'):
+            if key not in selected_fields:
+                selected_fields.insert(0, key)
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    total = len(containers)
+    next_cursor = None
+    if limit is not None or cursor is not None:
+        containers, next_cursor = paginate(containers, container_sort_key, limit, cursor)
+
+    result = {
+        "total": total,
+        "containers": [project(c, selected_fields) for c in containers]
     }
+    if limit is not None or cursor is not None:
+        result["next_cursor"] = next_cursor
+    return fast_response(result, response)
 
 @app.get("/api/remote/metrics")
-def get_remote_metrics():
+def get_remote_metrics(request: Request, response: Response):
     """Obtiene métricas agregadas de todos los servidores"""
+    etag = make_etag(request, "metrics", agent_manager.version)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
+
     return agent_manager.get_aggregated_metrics()
 
 # ============= DEPLOYMENT ENDPOINTS =============
@@ -825,89 +1465,10 @@ async def deploy_agent_endpoint(request: DeploymentRequest):
     }
 
 @app.get("/api/topology/unified")
-def get_unified_topology():
-    """Obtiene topología unificada: local + remota"""
-    # Servicios locales
-    local_services = load_services()
-    
-    # Contenedores remotos
-    remote_containers = agent_manager.get_all_containers()
-    
-    # Convertir contenedores remotos a formato de servicio
-    remote_services = []
-    for container in remote_containers:
-        remote_services.append({
-            "id": f"remote-{container['server_id']}-{container['id']}",
-            "name": container['name'],
-            "description": f"Remote container on {container['server_hostname']}",
-            "url": f"http://{container['server_ip']}",
-            "icon": "🌐",
-            "category": "remote",
-            "color": "#9333ea",
-            "isActive": container['status'] == 'running',
-            "status": container['status'],
-            "app_group": f"{container['server_hostname']}-{container.get('app_group', 'unknown')}",
-            "networks": container.get('networks', []),
-            "server_id": container['server_id'],
-            "server_hostname": container['server_hostname'],
-            "is_remote": True
-        })
-    
-    # Combinar todos los servicios
-    all_services = local_services + remote_services
-    
-    # Agrupar por app_group
-    groups = {}
-    connections = []
-    
-    for service in all_services:
-        app_group = service.get('app_group', 'uncategorized')
-        
-        if app_group not in groups:
-            groups[app_group] = {
-                "id": app_group,
-                "name": app_group,
-                "services": [],
-                "is_remote": service.get('is_remote', False)
-            }
-        
-        groups[app_group]["services"].append({
-            "id": service["id"],
-            "name": service["name"],
-            "status": service.get("status", "unknown"),
-            "isActive": service.get("isActive", True),
-            "icon": service.get("icon", "🔗"),
-            "networks": service.get("networks", []),
-            "is_remote": service.get("is_remote", False),
-            "server_hostname": service.get("server_hostname", "local")
-        })
-    
-    # Detectar conexiones
-    network_map = {}
-    for service in all_services:
-        for network in service.get("networks", []):
-            if network not in network_map:
-                network_map[network] = []
-            network_map[network].append(service["id"])
-    
-    for network, service_ids in network_map.items():
-        if len(service_ids) > 1:
-            for i, source in enumerate(service_ids):
-                for target in service_ids[i+1:]:
-                    connections.append({
-                        "source": source,
-                        "target": target,
-                        "network": network
-                    })
-    
-    return {
-        "groups": list(groups.values()),
-        "connections": connections,
-        "total_services": len(all_services),
-        "local_services": len(local_services),
-        "remote_services": len(remote_services),
-        "active_services": len([s for s in all_services if s.get("isActive", True)])
-    }
+def get_unified_topology(request: Request, fmt: str = Query("pairs", alias="format")):
+    """Obtiene topología unificada: local + remota (admite format=pairs|hub)"""
+    _check_topology_format(fmt)
+    return _topology_response(request, unified_topology, fmt)
 
 if __name__ == "__main__":
     import uvicorn
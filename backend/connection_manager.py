@@ -0,0 +1,480 @@
+"""
+Connection Manager - Clientes WebSocket de tráfico (/ws/traffic)
+Cada cliente tiene su propia cola de salida acotada y una tarea escritora:
+los productores encolan sin esperar y un navegador lento no frena al resto.
+Un keepalive ping/pong retira las conexiones medio abiertas y, en modo frames,
+los eventos de tráfico se agrupan en un mensaje por ventana. Cada cliente puede
+suscribirse a un subconjunto del tráfico (servicios, servidores, clase de
+status y tasa de muestreo)
+"""
+
+from typing import Deque, Dict, FrozenSet, List, Optional, Set
+from collections import deque
+import asyncio
+import itertools
+import json
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from fast_json import dumps
+from traffic import status_class
+
+# Políticas para clientes que no consumen al ritmo de los productores
+SLOW_CLIENT_POLICIES = ("drop_oldest", "disconnect")
+
+# Motivos por los que el manager retira una conexión
+REAP_REASONS = ("timeout", "send_error", "slow")
+
+# server_id con el que se suscribe al tráfico local (eventos sin server_id)
+LOCAL_SERVER_ID = "local"
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx", "other")
+
+
+class TrafficFrame:
+    """Eventos de tráfico de una ventana.
+
+    Guarda hasta max_samples eventos completos; del resto solo cuenta por
+    arista (from, to) y clase de status, así los totales siguen siendo exactos.
+    """
+
+    def __init__(self, max_samples: int):
+        self.max_samples = max_samples
+        self.samples: List[dict] = []
+        # (from, to) -> {"count": n, "by_status": {"2xx": n, ...}}
+        self.overflow: Dict[tuple, dict] = {}
+        self.total = 0
+
+    def add(self, event: dict, sampled: bool = True):
+        self.total += 1
+        if sampled and len(self.samples) < self.max_samples:
+            self.samples.append(event)
+            return
+        key = (event.get("from"), event.get("to"))
+        edge = self.overflow.get(key)
+        if edge is None:
+            edge = self.overflow[key] = {"count": 0, "by_status": {}}
+        edge["count"] += 1
+        klass = status_class(event.get("status"))
+        edge["by_status"][klass] = edge["by_status"].get(klass, 0) + 1
+
+    def message(self, window_ms: float) -> dict:
+        return {
+            "type": "frame",
+            "window_ms": window_ms,
+            "timestamp": time.time(),
+            "total": self.total,
+            "samples": self.samples,
+            "overflow": [
+                {"from": source, "to": target, **edge}
+                for (source, target), edge in self.overflow.items()
+            ],
+        }
+
+
+class Subscription:
+    """Filtro de tráfico de un cliente (None = sin filtrar por ese campo)"""
+
+    def __init__(self, services: Optional[FrozenSet[str]] = None,
+                 server_ids: Optional[FrozenSet[str]] = None,
+                 status: Optional[FrozenSet[str]] = None,
+                 sample_rate: float = 1.0):
+        self.services = services
+        self.server_ids = server_ids
+        self.status = status
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_message(cls, data: dict) -> 'Subscription':
+        """Construye la suscripción desde {"type": "subscribe", ...}; ValueError si es inválida"""
+        def names(key):
+            value = data.get(key)
+            if value is None:
+                return None
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                raise ValueError(f"{key} must be a list of strings")
+            return frozenset(value)
+
+        status = names("status")
+        if status is not None and not status <= set(STATUS_CLASSES):
+            raise ValueError(f"status must contain only {', '.join(STATUS_CLASSES)}")
+
+        sample_rate = data.get("sample_rate", 1.0)
+        if isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float)) or not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be a number in (0, 1]")
+
+        return cls(names("services"), names("server_ids"), status, float(sample_rate))
+
+    @property
+    def key(self) -> tuple:
+        return (self.services, self.server_ids, self.status, self.sample_rate)
+
+    def accepts(self, event: dict) -> bool:
+        """Filtros de servidor y status (el de servicios lo resuelve el índice)"""
+        if self.server_ids is not None and (event.get("server_id") or LOCAL_SERVER_ID) not in self.server_ids:
+            return False
+        if self.status is not None and status_class(event.get("status")) not in self.status:
+            return False
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "services": sorted(self.services) if self.services is not None else None,
+            "server_ids": sorted(self.server_ids) if self.server_ids is not None else None,
+            "status": sorted(self.status) if self.status is not None else None,
+            "sample_rate": self.sample_rate,
+        }
+
+
+class SubscriptionGroup:
+    """Clientes con la misma suscripción: comparten filtrado, muestreo y frame"""
+
+    def __init__(self, subscription: Subscription, frame_samples: int):
+        self.subscription = subscription
+        self.clients: Set['ClientConnection'] = set()
+        self.frame = TrafficFrame(frame_samples)
+        # Acumulador del muestreo determinista (envía exactamente sample_rate de los eventos)
+        self._sample_credit = 0.0
+
+    def sample(self) -> bool:
+        if self.subscription.sample_rate >= 1:
+            return True
+        self._sample_credit += self.subscription.sample_rate
+        if self._sample_credit >= 1:
+            self._sample_credit -= 1
+            return True
+        return False
+
+
+class ClientConnection:
+    """Cola de salida y contadores de un cliente"""
+
+    def __init__(self, client_id: int, websocket: WebSocket):
+        self.id = client_id
+        self.websocket = websocket
+        # (instante de encolado, mensaje serializado)
+        self.queue: Deque[tuple] = deque()
+        # Ping pendiente: va fuera de la cola (no cuenta en su límite ni en el lag)
+        self.ping: Optional[str] = None
+        self.ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.group: Optional[SubscriptionGroup] = None
+        self.connected_at = time.time()
+        # Último mensaje recibido del cliente (pong u otro)
+        self.last_seen = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+        self.closing = False
+
+    def lag_ms(self) -> float:
+        """Antigüedad del mensaje más viejo pendiente de enviar"""
+        if not self.queue:
+            return 0.0
+        return round((time.monotonic() - self.queue[0][0]) * 1000, 1)
+
+    def stats(self) -> dict:
+        client = self.websocket.client
+        return {
+            "id": self.id,
+            "address": f"{client.host}:{client.port}" if client else None,
+            "connected_at": self.connected_at,
+            "queued": len(self.queue),
+            "lag_ms": self.lag_ms(),
+            "idle_s": round(time.monotonic() - self.last_seen, 1),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "subscription": self.group.subscription.to_dict() if self.group else None,
+        }
+
+
+class ConnectionManager:
+    """Fan-out de mensajes a los clientes de /ws/traffic"""
+
+    def __init__(self, queue_size: int = 10000, policy: str = "drop_oldest",
+                 ping_interval: float = 20, ping_timeout: float = 60,
+                 frame_interval: float = 0.1, frame_samples: int = 200):
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Política desconocida: {policy} (usar {', '.join(SLOW_CLIENT_POLICIES)})")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self._ids = itertools.count(1)
+        self._keepalive: Optional[asyncio.Task] = None
+        # Modo frames (frame_interval > 0): un mensaje por ventana con muestras + conteos
+        self.frame_interval = frame_interval
+        self.frame_samples = frame_samples
+        self._frame_task: Optional[asyncio.Task] = None
+        self.frames_sent = 0
+        self.events_coalesced = 0
+        # Conexiones retiradas por el manager, por motivo
+        self.reaped: Dict[str, int] = {reason: 0 for reason in REAP_REASONS}
+        # Índice de suscripciones: clave -> grupo, servicio -> grupos, grupos sin filtro de servicio
+        self._groups: Dict[tuple, SubscriptionGroup] = {}
+        self._by_service: Dict[str, Set[SubscriptionGroup]] = {}
+        self._all_services: Set[SubscriptionGroup] = set()
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = ClientConnection(next(self._ids), websocket)
+        client.writer = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+        # Sin mensaje de suscripción el cliente recibe todo el tráfico
+        self._join(client, Subscription())
+
+    async def serve(self, websocket: WebSocket):
+        """Atiende un cliente hasta que se desconecta o es retirado"""
+        await self.connect(websocket)
+        try:
+            while websocket in self.clients:
+                message = await websocket.receive_text()
+                self.handle_message(websocket, message)
+        except (WebSocketDisconnect, RuntimeError):
+            # RuntimeError: el socket ya fue cerrado por el manager
+            pass
+        finally:
+            self.disconnect(websocket)
+
+    def handle_message(self, websocket: WebSocket, message: str):
+        """Cualquier mensaje del cliente (pong incluido) cuenta como actividad.
+
+        {"type": "subscribe", "services": [...], "server_ids": [...],
+        "status": ["5xx"], "sample_rate": 0.1} reemplaza la suscripción.
+        """
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        client.last_seen = time.monotonic()
+
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return
+        if not isinstance(data, dict) or data.get("type") != "subscribe":
+            return
+        try:
+            subscription = Subscription.from_message(data)
+        except ValueError as e:
+            self._send(client, {"type": "error", "detail": str(e)})
+            return
+        self._join(client, subscription)
+        self._send(client, {"type": "subscribed", "subscription": subscription.to_dict()})
+
+    # ------------------------------------------------------------------
+    # Suscripciones
+    # ------------------------------------------------------------------
+
+    def _join(self, client: ClientConnection, subscription: Subscription):
+        self._leave(client)
+        group = self._groups.get(subscription.key)
+        if group is None:
+            group = self._groups[subscription.key] = SubscriptionGroup(subscription, self.frame_samples)
+            if subscription.services is None:
+                self._all_services.add(group)
+            else:
+                for service in subscription.services:
+                    self._by_service.setdefault(service, set()).add(group)
+        group.clients.add(client)
+        client.group = group
+
+    def _leave(self, client: ClientConnection):
+        group = client.group
+        if group is None:
+            return
+        client.group = None
+        group.clients.discard(client)
+        if group.clients:
+            return
+        del self._groups[group.subscription.key]
+        if group.subscription.services is None:
+            self._all_services.discard(group)
+        else:
+            for service in group.subscription.services:
+                groups = self._by_service.get(service)
+                if groups is not None:
+                    groups.discard(group)
+                    if not groups:
+                        del self._by_service[service]
+
+    def _matching_groups(self, event: dict):
+        groups = self._all_services
+        source = self._by_service.get(event.get("from"))
+        target = self._by_service.get(event.get("to"))
+        if source or target:
+            groups = groups | (source or set()) | (target or set())
+        return [group for group in groups if group.subscription.accepts(event)]
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        self._leave(client)
+        client.closing = True
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    def publish(self, message: dict):
+        """Encola un mensaje para todos los clientes (no espera ningún envío)"""
+        if not self.clients:
+            return
+        self._enqueue(list(self.clients.values()), dumps(message).decode("utf-8"))
+
+    def _send(self, client: ClientConnection, message: dict):
+        self._enqueue([client], dumps(message).decode("utf-8"))
+
+    def _enqueue(self, clients, text: str):
+        now = time.monotonic()
+        for client in clients:
+            if client.closing:
+                continue
+            if len(client.queue) >= self.queue_size:
+                if self.policy == "disconnect":
+                    self._drop_client(client)
+                    continue
+                client.queue.popleft()
+                client.dropped += 1
+            client.queue.append((now, text))
+            client.ready.set()
+
+    async def broadcast(self, message: dict):
+        """Compatibilidad: equivalente a publish()"""
+        self.publish(message)
+
+    def publish_traffic(self, events: List[dict]):
+        """Publica eventos de tráfico a las suscripciones que los aceptan.
+
+        En modo frames se agregan al frame de cada grupo (los descartados por
+        el muestreo solo cuentan en overflow); si no, se envía un mensaje por
+        evento muestreado.
+        """
+        if not self.clients:
+            return
+        framed = self.frame_interval > 0
+        for event in events:
+            text = None
+            for group in self._matching_groups(event):
+                sampled = group.sample()
+                if framed:
+                    group.frame.add(event, sampled)
+                elif sampled:
+                    if text is None:
+                        text = dumps(event).decode("utf-8")
+                    self._enqueue(list(group.clients), text)
+
+    def flush_frame(self):
+        """Envía el frame acumulado de cada grupo (si tiene eventos) y empieza uno nuevo"""
+        window_ms = round(self.frame_interval * 1000)
+        for group in list(self._groups.values()):
+            frame = group.frame
+            if not frame.total:
+                continue
+            group.frame = TrafficFrame(self.frame_samples)
+            self.frames_sent += 1
+            self.events_coalesced += frame.total
+            self._enqueue(list(group.clients), dumps(frame.message(window_ms)).decode("utf-8"))
+
+    async def _frame_loop(self):
+        while True:
+            await asyncio.sleep(self.frame_interval)
+            self.flush_frame()
+
+    def _drop_client(self, client: ClientConnection):
+        print(f"🐢 Cliente de tráfico {client.id} desconectado por lentitud ({len(client.queue)} mensajes pendientes)")
+        client.dropped += len(client.queue)
+        client.queue.clear()
+        self._reap(client, "slow", 1008)
+
+    def _reap(self, client: ClientConnection, reason: str, code: int = 1001):
+        """Retira una conexión del manager y la cierra en segundo plano"""
+        if self.clients.get(client.websocket) is not client:
+            return
+        self.reaped[reason] += 1
+        self.disconnect(client.websocket)
+        asyncio.create_task(self._close(client.websocket, code))
+
+    async def _close(self, websocket: WebSocket, code: int = 1000):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _writer(self, client: ClientConnection):
+        try:
+            while not client.closing:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.ping is not None or client.queue:
+                    if client.ping is not None:
+                        # El ping se adelanta a los mensajes pendientes
+                        text, client.ping = client.ping, None
+                        await client.websocket.send_text(text)
+                        continue
+                    _, text = client.queue.popleft()
+                    await client.websocket.send_text(text)
+                    client.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"🔌 Cliente de tráfico {client.id} retirado tras error de envío: {e}")
+            self._reap(client, "send_error")
+
+    # ------------------------------------------------------------------
+    # Keepalive
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._keepalive is None and self.ping_interval > 0:
+            self._keepalive = asyncio.create_task(self._keepalive_loop())
+        if self._frame_task is None and self.frame_interval > 0:
+            self._frame_task = asyncio.create_task(self._frame_loop())
+
+    async def stop(self):
+        for task in (self._keepalive, self._frame_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._keepalive = None
+        self._frame_task = None
+
+    async def _keepalive_loop(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self.ping()
+
+    def ping(self):
+        """Envía un ping a cada cliente y retira los que superaron el timeout sin responder"""
+        now = time.monotonic()
+        ping = dumps({"type": "ping", "timestamp": time.time()}).decode("utf-8")
+        for client in list(self.clients.values()):
+            if now - client.last_seen > self.ping_timeout:
+                print(f"💀 Cliente de tráfico {client.id} retirado: sin respuesta en {self.ping_timeout}s")
+                self._reap(client, "timeout")
+                continue
+            client.ping = ping
+            client.ready.set()
+
+    def stats(self) -> dict:
+        clients = [client.stats() for client in self.clients.values()]
+        return {
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "active": len(clients),
+            "reaped": dict(self.reaped),
+            "subscription_groups": len(self._groups),
+            "frames": {
+                "interval_ms": round(self.frame_interval * 1000),
+                "max_samples": self.frame_samples,
+                "sent": self.frames_sent,
+                "events": self.events_coalesced,
+            },
+            "clients": clients,
+        }
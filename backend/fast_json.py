@@ -0,0 +1,38 @@
+"""
+Fast JSON - Serialización rápida para las respuestas grandes
+Usa orjson si está instalado y json de la librería estándar si no
+"""
+
+from typing import Any
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa a JSON compacto en UTF-8 (mismo formato que JSONResponse)"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    """Parsea JSON desde bytes o str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que serializa con dumps() sin pasar por jsonable_encoder.
+
+    El contenido debe estar ya normalizado (dicts, listas y escalares JSON).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,135 @@
+"""
+Remote Services - Conversión memoizada de contenedores remotos a servicios
+Cada vista (API de servicios, topología, topología unificada) registra su
+conversor; el resultado se cachea por (server_id, container id) mientras el
+contenido del contenedor reportado en el heartbeat no cambie
+"""
+
+from typing import Callable, Dict, Iterable, List, Tuple
+import threading
+
+from agent_manager import same_except_metrics
+
+
+class RemoteServiceCache:
+    """Contenedores remotos normalizados y sus servicios convertidos por vista.
+
+    Los registros devueltos se comparten entre requests: los consumidores no
+    deben mutarlos (copiar antes de modificar).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # kind -> conversor contenedor -> servicio
+        self._converters: Dict[str, Callable[[dict], dict]] = {}
+        # server_id -> {"source": lista del heartbeat, "entries": {container_id: entry}}
+        # entry = {"container": contenedor con datos del servidor, "services": {kind: servicio}}
+        self._servers: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, kind: str, converter: Callable[[dict], dict]):
+        """Registra el conversor de una vista"""
+        with self._lock:
+            self._converters[kind] = converter
+            for server in self._servers.values():
+                for entry in server["entries"].values():
+                    entry["services"].pop(kind, None)
+
+    # ------------------------------------------------------------------
+    # Invalidación
+    # ------------------------------------------------------------------
+
+    def refresh(self, server) -> Dict[str, dict]:
+        """Revalida las entradas de un servidor contra su último heartbeat.
+
+        Un contenedor cuyo contenido no cambió conserva sus conversiones; uno
+        nuevo o modificado empieza sin caché; los que desaparecen se descartan.
+        """
+        with self._lock:
+            cached = self._servers.get(server.id)
+            if (cached is not None and cached["source"] is server.containers
+                    and cached["hostname"] == server.hostname and cached["ip"] == server.ip):
+                return cached["entries"]
+
+            previous = cached["entries"] if cached is not None else {}
+            entries = {}
+            for container in server.containers:
+                container_data = dict(container)
+                container_data['server_id'] = server.id
+                container_data['server_hostname'] = server.hostname
+                container_data['server_ip'] = server.ip
+                container_data['is_remote'] = True
+
+                entry = previous.get(container_data.get('id'))
+                if entry is None or not same_except_metrics(entry["container"], container_data):
+                    entry = {"container": container_data, "services": {}}
+                elif entry["container"] != container_data:
+                    # Solo cambiaron las métricas (ningún conversor las lee): contenedor actualizado, conversiones vigentes
+                    entry = {"container": container_data, "services": entry["services"]}
+                entries[container_data.get('id')] = entry
+
+            self._servers[server.id] = {
+                "source": server.containers,
+                "hostname": server.hostname,
+                "ip": server.ip,
+                "entries": entries,
+            }
+            return entries
+
+    def apply_agent_event(self, event: str, server):
+        """Listener del AgentManager: revalida el servidor en cada heartbeat"""
+        if event in ('connected', 'updated'):
+            self.refresh(server)
+
+    # ------------------------------------------------------------------
+    # Lecturas
+    # ------------------------------------------------------------------
+
+    def _service(self, kind: str, entry: dict) -> dict:
+        service = entry["services"].get(kind)
+        if service is None:
+            self.misses += 1
+            service = self._converters[kind](entry["container"])
+            entry["services"][kind] = service
+        else:
+            self.hits += 1
+        return service
+
+    def containers(self, servers: Iterable) -> List[dict]:
+        """Contenedores de todos los servidores con server_id/server_hostname/server_ip"""
+        with self._lock:
+            return [
+                entry["container"]
+                for server in servers
+                for entry in self.refresh(server).values()
+            ]
+
+    def server_services(self, kind: str, server) -> List[Tuple[dict, dict]]:
+        """(contenedor, servicio convertido) de un servidor"""
+        with self._lock:
+            return [(entry["container"], self._service(kind, entry)) for entry in self.refresh(server).values()]
+
+    def convert(self, kind: str, container: dict) -> dict:
+        """Servicio convertido para un contenedor devuelto por containers()"""
+        with self._lock:
+            server = self._servers.get(container.get('server_id'))
+            entry = server["entries"].get(container.get('id')) if server is not None else None
+            if entry is None or (entry["container"] is not container and entry["container"] != container):
+                # Contenedor ajeno a la caché: convertir sin memoizar
+                self.misses += 1
+                return self._converters[kind](container)
+            return self._service(kind, entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "servers": len(self._servers),
+                "containers": sum(len(s["entries"]) for s in self._servers.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Instancia global
+remote_services = RemoteServiceCache()
@@ -0,0 +1,660 @@
+"""
+Service Store - Almacenamiento de servicios locales
+Interfaz común con dos implementaciones:
+- JournalServiceStore: registro en memoria + journal append-only compactado en services.json
+- SQLiteServiceStore: SQLite en modo WAL con columnas indexadas
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Campos escalares filtrables con índice (valor tal como lo devuelve service.get)
+QUERY_FIELDS = ("category", "server_id", "app_group", "status", "isActive", "is_remote")
+
+# Cambio notificado a los listeners: (op, service_id, servicio)
+# op: 'put' (servicio nuevo/actualizado), 'delete' (servicio=None) o 'reset' (recargar todo)
+StoreChange = Tuple[str, Optional[str], Optional[dict]]
+
+
+class ServiceValidationError(ValueError):
+    """Servicio con un valor no escalar en un campo indexado"""
+
+
+def check_query_fields(service: dict):
+    """Los campos de QUERY_FIELDS se usan como clave de índice: deben ser escalares"""
+    for field in QUERY_FIELDS:
+        value = service.get(field)
+        if value is not None and not isinstance(value, (str, int, float, bool)):
+            raise ServiceValidationError(f"{field} must be a scalar value")
+
+
+class ServiceStore(ABC):
+    """Interfaz de almacenamiento usada por los endpoints de servicios"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._listeners: List[Callable[[List[StoreChange]], None]] = []
+
+    def add_listener(self, listener: Callable[[List[StoreChange]], None]):
+        """Registra un callback invocado tras cada mutación (dentro del lock del store)"""
+        self._listeners.append(listener)
+
+    def _notify(self, changes: List[StoreChange]):
+        if not changes:
+            return
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                print(f"Error en listener del store de servicios: {e}")
+
+    @abstractmethod
+    def all(self) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, service_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_by_name(self, name: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def next_id(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def categories(self) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(self, filters: Dict[str, object], name_prefix: Optional[str] = None) -> List[dict]:
+        """Servicios que cumplen todos los filtros (campos de QUERY_FIELDS) usando índices"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put(self, service: dict) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def patch(self, service_id: str, updates: dict) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, service_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace_all(self, services: List[dict]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply(self, puts: List[dict], deletes: List[str]):
+        """Aplica un lote de puts/deletes como una sola transacción"""
+        raise NotImplementedError
+
+    def locked(self):
+        """Lock del store para secuencias leer-diff-escribir que no deben intercalarse"""
+        return self._lock
+
+    def compact_if_dirty(self) -> bool:
+        """Mantenimiento periódico (compactación, checkpoint...)"""
+        return False
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        raise NotImplementedError
+
+
+class JournalServiceStore(ServiceStore):
+    """Registro autoritativo en memoria con journal de escritura diferida.
+
+    - services.json es el snapshot compactado (formato compatible con versiones previas)
+    - services.json.journal contiene una operación por línea (put/delete)
+    - Al arrancar se carga el snapshot, se reproduce el journal y se compacta
+    """
+
+    def __init__(self, data_file: str, compact_every: int = 1000, fsync: bool = False):
+        super().__init__()
+        self.data_file = data_file
+        self.journal_file = f"{data_file}.journal"
+        self.compact_every = compact_every
+        self.fsync = fsync
+
+        # id -> servicio (el orden de inserción se conserva como en el archivo)
+        self._services: Dict[str, dict] = {}
+        # name -> id (detección de duplicados del docker-monitor)
+        self._by_name: Dict[str, str] = {}
+        # campo -> valor -> {id: None} (índices secundarios para query)
+        self._by_field: Dict[str, Dict[object, Dict[str, None]]] = {field: {} for field in QUERY_FIELDS}
+        self._max_numeric_id = 0
+
+        self._journal = None
+        self._pending_ops = 0
+        self.last_compaction: Optional[float] = None
+
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Carga / persistencia
+    # ------------------------------------------------------------------
+
+    def _load(self):
+        os.makedirs(os.path.dirname(self.data_file) or ".", exist_ok=True)
+
+        if os.path.exists(self.data_file):
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                for service in json.load(f):
+                    self._index_put(service)
+
+        replayed = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Última línea truncada por un corte abrupto: se descarta
+                        print(f"⚠️  Entrada de journal corrupta ignorada en {self.journal_file}")
+                        continue
+                    self._apply(entry)
+                    replayed += 1
+
+        if replayed:
+            print(f"📒 Journal reproducido: {replayed} operaciones")
+
+        # Dejar el snapshot al día y el journal vacío
+        self.compact()
+
+    def _open_journal(self):
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        return self._journal
+
+    def _append(self, entries: List[dict]):
+        """Escribe operaciones al journal: coste O(cambio), no O(archivo)"""
+        journal = self._open_journal()
+        journal.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries))
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+
+        self._pending_ops += len(entries)
+        if self.compact_every and self._pending_ops >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Vuelca el estado en services.json (rename atómico) y trunca el journal"""
+        with self._lock:
+            tmp_file = f"{self.data_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(list(self._services.values()), f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.data_file)
+
+            # Las operaciones son idempotentes (put = registro completo), así que
+            # un corte entre el rename y el truncado solo repite trabajo al arrancar
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            open(self.journal_file, 'w', encoding='utf-8').close()
+
+            self._pending_ops = 0
+            self.last_compaction = time.time()
+
+    def compact_if_dirty(self) -> bool:
+        """Compacta solo si hay operaciones pendientes en el journal"""
+        with self._lock:
+            if not self._pending_ops:
+                return False
+            self.compact()
+            return True
+
+    def close(self):
+        self.compact_if_dirty()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    # ------------------------------------------------------------------
+    # Índices
+    # ------------------------------------------------------------------
+
+    def _apply(self, entry: dict):
+        op = entry.get('op')
+        if op == 'put':
+            self._index_put(entry['service'])
+        elif op == 'delete':
+            self._index_delete(entry['id'])
+
+    def _index_put(self, service: dict):
+        check_query_fields(service)
+        service_id = service['id']
+        previous = self._services.get(service_id)
+        if previous is not None:
+            self._unindex(service_id, previous)
+
+        self._services[service_id] = service
+        if service.get('name') is not None:
+            self._by_name[service['name']] = service_id
+        for field, index in self._by_field.items():
+            index.setdefault(service.get(field), {})[service_id] = None
+        if str(service_id).isdigit():
+            self._max_numeric_id = max(self._max_numeric_id, int(service_id))
+
+    def _unindex(self, service_id: str, service: dict):
+        if self._by_name.get(service.get('name')) == service_id:
+            del self._by_name[service.get('name')]
+        for field, index in self._by_field.items():
+            ids = index.get(service.get(field))
+            if ids is not None:
+                ids.pop(service_id, None)
+                if not ids:
+                    del index[service.get(field)]
+
+    def _index_delete(self, service_id: str) -> Optional[dict]:
+        service = self._services.pop(service_id, None)
+        if service is not None:
+            self._unindex(service_id, service)
+        return service
+
+    # ------------------------------------------------------------------
+    # Lecturas (nunca tocan disco)
+    # ------------------------------------------------------------------
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            return list(self._services.values())
+
+    def get(self, service_id: str) -> Optional[dict]:
+        return self._services.get(service_id)
+
+    def get_by_name(self, name: str) -> Optional[dict]:
+        with self._lock:
+            service_id = self._by_name.get(name)
+            return self._services.get(service_id) if service_id is not None else None
+
+    def next_id(self) -> str:
+        with self._lock:
+            return str(self._max_numeric_id + 1)
+
+    def categories(self) -> List[str]:
+        with self._lock:
+            return sorted(set(s.get("category", "general") for s in self._services.values()))
+
+    def query(self, filters: Dict[str, object], name_prefix: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            if filters:
+                # Partir del índice más selectivo y verificar el resto de filtros
+                candidates = min(
+                    (self._by_field[field].get(value, {}) for field, value in filters.items()),
+                    key=len,
+                )
+                services = (self._services[service_id] for service_id in candidates)
+            else:
+                services = self._services.values()
+
+            return [
+                service for service in services
+                if all(service.get(field) == value for field, value in filters.items())
+                and (name_prefix is None or str(service.get('name', '')).startswith(name_prefix))
+            ]
+
+    def __len__(self):
+        return len(self._services)
+
+    # ------------------------------------------------------------------
+    # Mutaciones
+    # ------------------------------------------------------------------
+
+    def put(self, service: dict) -> dict:
+        """Crea o reemplaza un servicio completo"""
+        with self._lock:
+            service = dict(service)
+            self._index_put(service)
+            self._append([{'op': 'put', 'service': service}])
+            self._notify([('put', service['id'], service)])
+            return service
+
+    def patch(self, service_id: str, updates: dict) -> Optional[dict]:
+        """Actualiza campos de un servicio (copy-on-write: los lectores nunca ven un dict a medias)"""
+        with self._lock:
+            current = self._services.get(service_id)
+            if current is None:
+                return None
+            service = {**current, **updates}
+            self._index_put(service)
+            self._append([{'op': 'put', 'service': service}])
+            self._notify([('put', service_id, service)])
+            return service
+
+    def delete(self, service_id: str) -> Optional[dict]:
+        with self._lock:
+            service = self._index_delete(service_id)
+            if service is not None:
+                self._append([{'op': 'delete', 'id': service_id}])
+                self._notify([('delete', service_id, None)])
+            return service
+
+    def apply(self, puts: List[dict], deletes: List[str]):
+        """Lote atómico: una sola escritura al journal para todo el lote"""
+        for service in puts:
+            check_query_fields(service)
+        with self._lock:
+            entries = []
+            changes = []
+            for service in puts:
+                service = dict(service)
+                self._index_put(service)
+                entries.append({'op': 'put', 'service': service})
+                changes.append(('put', service['id'], service))
+            for service_id in deletes:
+                if self._index_delete(service_id) is not None:
+                    entries.append({'op': 'delete', 'id': service_id})
+                    changes.append(('delete', service_id, None))
+            if entries:
+                self._append(entries)
+            self._notify(changes)
+
+    def replace_all(self, services: List[dict]):
+        """Reemplaza el registro completo (compatibilidad con save_services)"""
+        with self._lock:
+            self._services.clear()
+            self._by_name.clear()
+            for index in self._by_field.values():
+                index.clear()
+            self._max_numeric_id = 0
+            for service in services:
+                self._index_put(dict(service))
+            self.compact()
+            self._notify([('reset', None, None)])
+
+
+class SQLiteServiceStore(ServiceStore):
+    """Servicios en SQLite (WAL) con índices en las columnas de búsqueda.
+
+    El registro completo se guarda como JSON en `data`; las columnas indexadas
+    son copias de los campos por los que se busca o filtra.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS services (
+            id TEXT PRIMARY KEY,
+            num_id INTEGER,
+            name TEXT,
+            container_id TEXT,
+            category TEXT,
+            server_id TEXT,
+            is_active INTEGER,
+            app_group TEXT,
+            status TEXT,
+            is_remote INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_services_num_id ON services(num_id);
+        CREATE INDEX IF NOT EXISTS idx_services_name ON services(name);
+        CREATE INDEX IF NOT EXISTS idx_services_container_id ON services(container_id);
+        CREATE INDEX IF NOT EXISTS idx_services_category ON services(category);
+        CREATE INDEX IF NOT EXISTS idx_services_server_id ON services(server_id);
+        CREATE INDEX IF NOT EXISTS idx_services_is_active ON services(is_active);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, db_file: str, json_file: Optional[str] = None):
+        super().__init__()
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+
+        # Los handlers sync de FastAPI corren en un threadpool: una conexión
+        # compartida protegida por lock
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._ensure_query_columns()
+
+        if json_file:
+            self._migrate_from_json(json_file)
+
+    # Columnas añadidas después de la primera versión del esquema
+    QUERY_COLUMNS = ("app_group", "status", "is_remote")
+
+    def _ensure_query_columns(self):
+        """Agrega (y rellena) las columnas de filtrado en bases creadas con el esquema anterior"""
+        with self._lock:
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(services)")}
+            missing = [column for column in self.QUERY_COLUMNS if column not in existing]
+            for column in missing:
+                column_type = "INTEGER" if column == "is_remote" else "TEXT"
+                self._conn.execute(f"ALTER TABLE services ADD COLUMN {column} {column_type}")
+            for column in self.QUERY_COLUMNS:
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_services_{column} ON services({column})")
+            if missing:
+                for service in self.all():
+                    self._upsert(service)
+
+    def _migrate_from_json(self, json_file: str):
+        """Migración única desde services.json (+ journal pendiente si existe)"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+            if row or not os.path.exists(json_file):
+                return
+
+            # Reutiliza el store de journal para reproducir operaciones no compactadas
+            legacy = JournalServiceStore(json_file, compact_every=0)
+            services = legacy.all()
+            legacy.close()
+
+            self._conn.execute("BEGIN")
+            try:
+                for service in services:
+                    self._upsert(service)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                    (time.strftime("%Y-%m-%dT%H:%M:%S"),)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            print(f"🗄️  Migrados {len(services)} servicios de {json_file} a {self.db_file}")
+
+    def _upsert(self, service: dict):
+        check_query_fields(service)
+        service_id = str(service['id'])
+        self._conn.execute(
+            """
+            INSERT INTO services (id, num_id, name, container_id, category, server_id, is_active,
+                                  app_group, status, is_remote, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                num_id = excluded.num_id,
+                name = excluded.name,
+                container_id = excluded.container_id,
+                category = excluded.category,
+                server_id = excluded.server_id,
+                is_active = excluded.is_active,
+                app_group = excluded.app_group,
+                status = excluded.status,
+                is_remote = excluded.is_remote,
+                data = excluded.data
+            """,
+            (
+                service_id,
+                int(service_id) if service_id.isdigit() else None,
+                service.get('name'),
+                service.get('container_id'),
+                service.get('category', 'general'),
+                service.get('server_id'),
+                1 if service.get('isActive', True) else 0,
+                service.get('app_group'),
+                service.get('status'),
+                1 if service.get('is_remote') else 0,
+                json.dumps(service, ensure_ascii=False),
+            )
+        )
+
+    def _fetch_one(self, sql: str, params: tuple) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ------------------------------------------------------------------
+    # Lecturas
+    # ------------------------------------------------------------------
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM services ORDER BY rowid").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, service_id: str) -> Optional[dict]:
+        return self._fetch_one("SELECT data FROM services WHERE id = ?", (service_id,))
+
+    def get_by_name(self, name: str) -> Optional[dict]:
+        return self._fetch_one("SELECT data FROM services WHERE name = ? ORDER BY rowid DESC LIMIT 1", (name,))
+
+    def next_id(self) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(num_id) FROM services").fetchone()
+        return str((row[0] or 0) + 1)
+
+    def categories(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT category FROM services").fetchall()
+        return sorted(row[0] or "general" for row in rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM services").fetchone()[0]
+
+    # campo del servicio -> columna indexada
+    FIELD_COLUMNS = {
+        "category": "category",
+        "server_id": "server_id",
+        "app_group": "app_group",
+        "status": "status",
+        "isActive": "is_active",
+        "is_remote": "is_remote",
+    }
+
+    def query(self, filters: Dict[str, object], name_prefix: Optional[str] = None) -> List[dict]:
+        clauses, params = [], []
+        for field, value in filters.items():
+            column = self.FIELD_COLUMNS[field]
+            if value is None:
+                clauses.append(f"{column} IS NULL")
+                continue
+            clauses.append(f"{column} = ?")
+            params.append(int(value) if isinstance(value, bool) else value)
+        if name_prefix:
+            # Rango sobre el índice de name en lugar de LIKE
+            clauses.append("name >= ? AND name < ?")
+            params.extend([name_prefix, name_prefix + "\U0010ffff"])
+
+        sql = "SELECT data FROM services"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY rowid"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        services = [json.loads(row[0]) for row in rows]
+        # Las columnas normalizan valores ausentes: verificar contra el registro real
+        return [s for s in services if all(s.get(field) == value for field, value in filters.items())]
+
+    # ------------------------------------------------------------------
+    # Mutaciones
+    # ------------------------------------------------------------------
+
+    def put(self, service: dict) -> dict:
+        service = dict(service)
+        with self._lock:
+            self._upsert(service)
+            self._notify([('put', str(service['id']), service)])
+        return service
+
+    def patch(self, service_id: str, updates: dict) -> Optional[dict]:
+        with self._lock:
+            current = self.get(service_id)
+            if current is None:
+                return None
+            service = {**current, **updates}
+            self._upsert(service)
+            self._notify([('put', service_id, service)])
+            return service
+
+    def delete(self, service_id: str) -> Optional[dict]:
+        with self._lock:
+            current = self.get(service_id)
+            if current is not None:
+                self._conn.execute("DELETE FROM services WHERE id = ?", (service_id,))
+                self._notify([('delete', service_id, None)])
+            return current
+
+    def apply(self, puts: List[dict], deletes: List[str]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                changes = []
+                for service in puts:
+                    self._upsert(service)
+                    changes.append(('put', str(service['id']), dict(service)))
+                for service_id in deletes:
+                    if self._conn.execute("DELETE FROM services WHERE id = ?", (service_id,)).rowcount:
+                        changes.append(('delete', service_id, None))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._notify(changes)
+
+    def replace_all(self, services: List[dict]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM services")
+                for service in services:
+                    self._upsert(service)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._notify([('reset', None, None)])
+
+    def compact_if_dirty(self) -> bool:
+        """Checkpoint pasivo del WAL para que no crezca sin límite"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_service_store(backend: str, data_file: str, sqlite_file: str, compact_every: int = 1000) -> ServiceStore:
+    """Construye el store configurado (`journal` por defecto, o `sqlite`)"""
+    if backend == "sqlite":
+        return SQLiteServiceStore(sqlite_file, json_file=data_file)
+    if backend != "journal":
+        print(f"⚠️  Backend de servicios desconocido '{backend}', usando 'journal'")
+    return JournalServiceStore(data_file, compact_every=compact_every)
@@ -0,0 +1,552 @@
+"""
+Topology - Modelo de topología mantenido en memoria
+Se actualiza incrementalmente con los cambios del store de servicios y de los
+agentes remotos; las lecturas sirven un snapshot versionado ya serializado
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import threading
+
+from fast_json import dumps
+
+# Formatos de snapshot:
+# - pairs: una conexión por cada par de servicios en la misma red (compatibilidad, O(n²) por red)
+# - hub: cada red es un nodo hub con su lista de miembros (O(n))
+TOPOLOGY_FORMATS = ("pairs", "hub")
+
+
+def _without_last_seen(edges: List[dict]) -> List[dict]:
+    return [{key: value for key, value in edge.items() if key != "last_seen"} for edge in edges]
+
+
+class TopologyView(ABC):
+    """Define cómo se proyectan servicios locales y contenedores remotos en una vista"""
+
+    # Nombre de la vista en la caché de conversiones remotas
+    kind = "topology"
+
+    @abstractmethod
+    def remote_service(self, container: dict) -> dict:
+        """Convierte un contenedor remoto (con server_id/server_hostname) a formato servicio"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def project(self, service: dict) -> Tuple[str, dict, dict]:
+        """Devuelve (grupo, atributos extra del grupo, nodo) para un servicio"""
+        raise NotImplementedError
+
+    def totals(self, model: 'TopologyModel') -> dict:
+        return {}
+
+
+class DefaultTopologyView(TopologyView):
+    """Vista de /api/topology (SCADA)"""
+
+    def remote_service(self, container: dict) -> dict:
+        return {
+            "id": f"remote-{container['server_id']}-{container['id']}",
+            "name": container["name"],
+            "status": container.get("status", "unknown"),
+            "isActive": container.get("status") == "running",
+            "icon": "🌐",
+            "networks": container.get("networks", []),
+            "app_group": f"remote-{container['server_hostname']}",
+            "is_remote": True,
+            "server_id": container['server_id'],
+            "server_hostname": container['server_hostname'],
+            "container_id": f"remote-{container['server_id']}-{container['id']}"
+        }
+
+    def project(self, service: dict) -> Tuple[str, dict, dict]:
+        return service.get("app_group", "uncategorized"), {}, {
+            "id": service["id"],
+            "name": service["name"],
+            "status": service.get("status", "unknown"),
+            "isActive": service.get("isActive", True),
+            "icon": service.get("icon", "🔗"),
+            "networks": service.get("networks", []),
+            "is_remote": service.get("is_remote", False),
+            "server_hostname": service.get("server_hostname"),
+            "container_id": service.get("container_id")
+        }
+
+
+class UnifiedTopologyView(TopologyView):
+    """Vista de /api/topology/unified (local + remota)"""
+
+    kind = "unified"
+
+    def remote_service(self, container: dict) -> dict:
+        return {
+            "id": f"remote-{container['server_id']}-{container['id']}",
+            "name": container['name'],
+            "description": f"Remote container on {container['server_hostname']}",
+            "url": f"http://{container['server_ip']}",
+            "icon": "🌐",
+            "category": "remote",
+            "color": "#9333ea",
+            "isActive": container['status'] == 'running',
+            "status": container['status'],
+            "app_group": f"{container['server_hostname']}-{container.get('app_group', 'unknown')}",
+            "networks": container.get('networks', []),
+            "server_id": container['server_id'],
+            "server_hostname": container['server_hostname'],
+            "is_remote": True
+        }
+
+    def project(self, service: dict) -> Tuple[str, dict, dict]:
+        return service.get('app_group', 'uncategorized'), {"is_remote": service.get('is_remote', False)}, {
+            "id": service["id"],
+            "name": service["name"],
+            "status": service.get("status", "unknown"),
+            "isActive": service.get("isActive", True),
+            "icon": service.get("icon", "🔗"),
+            "networks": service.get("networks", []),
+            "is_remote": service.get("is_remote", False),
+            "server_hostname": service.get("server_hostname", "local")
+        }
+
+    def totals(self, model: 'TopologyModel') -> dict:
+        remote = sum(len(ids) for ids in model._remote_ids.values())
+        return {
+            "local_services": len(model._local_ids),
+            "remote_services": remote,
+        }
+
+
+class TopologyModel:
+    """Grupos, mapa de redes y conexiones mantenidos incrementalmente.
+
+    Cada mutación invalida solo el grupo y las redes afectadas; el snapshot
+    (y su JSON) se reconstruye como mucho una vez por versión y formato, así que
+    el coste de una lectura no depende del tamaño de la flota.
+    """
+
+    def __init__(self, view: TopologyView, remote_services=None):
+        self.view = view
+        self.version = 0
+        # RemoteServiceCache compartida (opcional): memoiza remote_service por heartbeat
+        self.remote_services = remote_services
+        if remote_services is not None:
+            remote_services.register(view.kind, view.remote_service)
+
+        self._lock = threading.RLock()
+        # node_id -> (grupo, nodo proyectado)
+        self._nodes: Dict[str, Tuple[str, dict]] = {}
+        self._local_ids: Dict[str, None] = {}
+        # server_id -> ids de nodos remotos de ese servidor
+        self._remote_ids: Dict[str, Dict[str, None]] = {}
+        # grupo -> {"extra": {...}, "members": {node_id: None}}
+        self._groups: Dict[str, dict] = {}
+        # red -> {node_id: None} (orden de inserción = orden de las conexiones)
+        self._networks: Dict[str, Dict[str, None]] = {}
+        self._active = 0
+        # Aristas observadas en el tráfico (TrafficEdgeStore.edges), por nombre de servicio
+        self._traffic_edges: List[dict] = []
+
+        # Caches invalidadas por grupo / red
+        self._group_cache: Dict[str, dict] = {}
+        self._connection_cache: Dict[str, List[dict]] = {}
+        self._hub_cache: Dict[str, dict] = {}
+        # formato -> [versión, snapshot, JSON serializado]
+        self._snapshots: Dict[str, list] = {}
+
+        # Callbacks que reciben cada delta (se invocan dentro del lock del modelo)
+        self._listeners: List[Callable[[dict], None]] = []
+
+    # ------------------------------------------------------------------
+    # Deltas
+    # ------------------------------------------------------------------
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """Registra un callback para los deltas tipados del modelo"""
+        self._listeners.append(listener)
+
+    def _emit(self, delta_type: str, **fields):
+        if not self._listeners:
+            return
+        delta = {
+            "type": delta_type,
+            "version": self.version,
+            **fields,
+            "total_services": len(self._nodes),
+            "active_services": self._active,
+        }
+        for listener in self._listeners:
+            try:
+                listener(delta)
+            except Exception as e:
+                print(f"Error en listener de topología: {e}")
+
+    @staticmethod
+    def _change_type(old_group: str, old: dict, new_group: str, new: dict) -> str:
+        """Clasifica el cambio de un nodo existente"""
+        if old_group != new_group:
+            return "service_updated"
+        changed = {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+        if changed <= {"status", "isActive"}:
+            return "status_changed"
+        if changed <= {"status", "isActive", "networks"}:
+            return "networks_changed"
+        return "service_updated"
+
+    # ------------------------------------------------------------------
+    # Mantenimiento de índices
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _node_networks(node: dict) -> List[str]:
+        return node.get("networks") or []
+
+    def _invalidate_network(self, network: str):
+        self._connection_cache.pop(network, None)
+        self._hub_cache.pop(network, None)
+
+    def _attach(self, node_id: str, group_id: str, extra: dict, node: dict):
+        self._nodes[node_id] = (group_id, node)
+
+        group = self._groups.get(group_id)
+        if group is None:
+            group = self._groups[group_id] = {"extra": extra, "members": {}}
+        group["members"][node_id] = None
+        self._group_cache.pop(group_id, None)
+
+        for network in self._node_networks(node):
+            self._networks.setdefault(network, {})[node_id] = None
+            self._invalidate_network(network)
+
+        if node.get("isActive", True):
+            self._active += 1
+
+    def _detach(self, node_id: str):
+        group_id, node = self._nodes.pop(node_id)
+
+        group = self._groups[group_id]
+        group["members"].pop(node_id, None)
+        if not group["members"]:
+            del self._groups[group_id]
+        self._group_cache.pop(group_id, None)
+
+        for network in self._node_networks(node):
+            members = self._networks.get(network)
+            if members is None:
+                continue
+            members.pop(node_id, None)
+            if not members:
+                del self._networks[network]
+            self._invalidate_network(network)
+
+        if node.get("isActive", True):
+            self._active -= 1
+
+    def _upsert(self, node_id: str, service: dict) -> bool:
+        group_id, extra, node = self.view.project(service)
+        current = self._nodes.get(node_id)
+
+        if current is not None:
+            current_group, current_node = current
+            if current_group == group_id and current_node == node:
+                return False
+
+            change = self._change_type(current_group, current_node, group_id, node)
+            if current_group == group_id and self._node_networks(current_node) == self._node_networks(node):
+                # Mismo grupo y redes: reemplazo en sitio (conserva el orden)
+                self._nodes[node_id] = (group_id, node)
+                self._group_cache.pop(group_id, None)
+                active_delta = int(node.get("isActive", True)) - int(current_node.get("isActive", True))
+                if active_delta:
+                    self._active += active_delta
+                    # Las conexiones no cambian, pero sí los contadores de los hubs
+                    for network in self._node_networks(node):
+                        self._hub_cache.pop(network, None)
+                self.version += 1
+                self._emit(change, id=node_id, group=group_id, service=node)
+                return True
+
+            self._detach(node_id)
+            self._attach(node_id, group_id, extra, node)
+            self.version += 1
+            old_networks = self._node_networks(current_node)
+            new_networks = self._node_networks(node)
+            self._emit(
+                change,
+                id=node_id,
+                group=group_id,
+                previous_group=current_group,
+                service=node,
+                added_networks=[n for n in new_networks if n not in old_networks],
+                removed_networks=[n for n in old_networks if n not in new_networks],
+            )
+            return True
+
+        self._attach(node_id, group_id, extra, node)
+        self.version += 1
+        self._emit("service_added", id=node_id, group=group_id, group_extra=extra, service=node)
+        return True
+
+    def _remove(self, node_id: str) -> bool:
+        if node_id not in self._nodes:
+            return False
+        group_id = self._nodes[node_id][0]
+        self._detach(node_id)
+        self.version += 1
+        self._emit("service_removed", id=node_id, group=group_id)
+        return True
+
+    # ------------------------------------------------------------------
+    # Entradas: store de servicios y agentes
+    # ------------------------------------------------------------------
+
+    def sync_local(self, services: List[dict]):
+        """Sincroniza todos los servicios locales (arranque o 'reset' del store)"""
+        with self._lock:
+            seen = {}
+            for service in services:
+                self._upsert(service["id"], service)
+                seen[service["id"]] = None
+            for node_id in [i for i in self._local_ids if i not in seen]:
+                self._remove(node_id)
+            self._local_ids = seen
+
+    def apply_store_changes(self, changes: list, store=None):
+        """Listener del store de servicios"""
+        with self._lock:
+            for op, service_id, service in changes:
+                if op == 'put':
+                    self._upsert(service_id, service)
+                    self._local_ids[service_id] = None
+                elif op == 'delete':
+                    self._remove(service_id)
+                    self._local_ids.pop(service_id, None)
+                elif op == 'reset' and store is not None:
+                    self.sync_local(store.all())
+
+    def sync_server(self, server):
+        """Sincroniza los contenedores de un agente tras un heartbeat"""
+        with self._lock:
+            previous = self._remote_ids.get(server.id, {})
+            seen = {}
+            for service in self._remote_services(server):
+                self._upsert(service["id"], service)
+                seen[service["id"]] = None
+            for node_id in [i for i in previous if i not in seen]:
+                self._remove(node_id)
+            self._remote_ids[server.id] = seen
+
+    def _remote_services(self, server) -> List[dict]:
+        if self.remote_services is not None:
+            return [service for _, service in self.remote_services.server_services(self.view.kind, server)]
+        services = []
+        for container in server.containers:
+            container_data = dict(container)
+            container_data['server_id'] = server.id
+            container_data['server_hostname'] = server.hostname
+            container_data['server_ip'] = server.ip
+            services.append(self.view.remote_service(container_data))
+        return services
+
+    def apply_agent_event(self, event: str, server):
+        """Listener del AgentManager"""
+        if event in ('connected', 'updated'):
+            self.sync_server(server)
+        if event in ('connected', 'disconnected'):
+            with self._lock:
+                self._emit(f"agent_{event}", server_id=server.id, hostname=server.hostname, ip=server.ip)
+
+    def set_traffic_edges(self, edges: List[dict]) -> bool:
+        """Reemplaza las aristas inferidas del tráfico; emite un delta si cambiaron.
+
+        last_seen avanza con cualquier evento: no cuenta como cambio (si no, cada
+        refresco con tráfico invalidaría el ETag y emitiría un delta sin novedades).
+        """
+        with self._lock:
+            if _without_last_seen(edges) == _without_last_seen(self._traffic_edges):
+                return False
+            self._traffic_edges = edges
+            self.version += 1
+            self._emit("traffic_edges", edges=self._resolved_traffic_edges())
+            return True
+
+    # ------------------------------------------------------------------
+    # Lecturas
+    # ------------------------------------------------------------------
+
+    def _resolved_traffic_edges(self) -> List[dict]:
+        """Aristas del tráfico con los ids de los nodos cuyo nombre coincide (None si no hay)"""
+        if not self._traffic_edges:
+            return []
+        by_name: Dict[str, str] = {}
+        for node_id, (_, node) in self._nodes.items():
+            by_name.setdefault(node.get("name"), node_id)
+        return [
+            {**edge, "source_id": by_name.get(edge["source"]), "target_id": by_name.get(edge["target"])}
+            for edge in self._traffic_edges
+        ]
+
+    def _group_output(self, group_id: str) -> dict:
+        cached = self._group_cache.get(group_id)
+        if cached is None:
+            group = self._groups[group_id]
+            cached = {
+                "id": group_id,
+                "name": group_id,
+                "services": [self._nodes[node_id][1] for node_id in group["members"]],
+                **group["extra"],
+            }
+            self._group_cache[group_id] = cached
+        return cached
+
+    def _network_connections(self, network: str) -> List[dict]:
+        cached = self._connection_cache.get(network)
+        if cached is None:
+            service_ids = list(self._networks[network])
+            cached = []
+            for i, source in enumerate(service_ids):
+                for target in service_ids[i+1:]:
+                    cached.append({
+                        "source": source,
+                        "target": target,
+                        "network": network
+                    })
+            self._connection_cache[network] = cached
+        return cached
+
+    def _network_hub(self, network: str) -> dict:
+        cached = self._hub_cache.get(network)
+        if cached is None:
+            members = list(self._networks[network])
+            cached = {
+                "id": network,
+                "name": network,
+                "members": members,
+                "count": len(members),
+                "active_count": sum(1 for node_id in members if self._nodes[node_id][1].get("isActive", True)),
+            }
+            self._hub_cache[network] = cached
+        return cached
+
+    def _build_snapshot(self, fmt: str) -> dict:
+        snapshot = {
+            "version": self.version,
+            "groups": [self._group_output(group_id) for group_id in self._groups],
+        }
+        if fmt == "hub":
+            snapshot["format"] = "hub"
+            snapshot["networks"] = [self._network_hub(network) for network in self._networks]
+            snapshot["total_networks"] = len(self._networks)
+        else:
+            connections = []
+            for network in self._networks:
+                connections.extend(self._network_connections(network))
+            snapshot["connections"] = connections
+        snapshot["traffic_edges"] = self._resolved_traffic_edges()
+
+        snapshot.update({
+            "total_services": len(self._nodes),
+            **self.view.totals(self),
+            "active_services": self._active,
+        })
+        return snapshot
+
+    def snapshot(self, fmt: str = "pairs") -> dict:
+        """Snapshot versionado (se reconstruye solo si la versión cambió)"""
+        with self._lock:
+            entry = self._snapshots.get(fmt)
+            if entry is None or entry[0] != self.version:
+                entry = self._snapshots[fmt] = [self.version, self._build_snapshot(fmt), None]
+            return entry[1]
+
+    def snapshot_json(self, fmt: str = "pairs") -> bytes:
+        """Snapshot ya serializado: las lecturas repetidas no vuelven a codificar"""
+        with self._lock:
+            self.snapshot(fmt)
+            entry = self._snapshots[fmt]
+            if entry[2] is None:
+                entry[2] = dumps(entry[1])
+            return entry[2]
+
+
+class TopologyStream:
+    """Canal WebSocket de topología: un snapshot inicial seguido de deltas tipados.
+
+    Los deltas llegan desde el modelo (hilos del threadpool o el propio event loop)
+    y se reparten a una cola acotada por cliente. Si un cliente se queda atrás,
+    se descartan sus deltas pendientes y se le reenvía un snapshot completo.
+    """
+
+    _RESYNC = object()
+
+    def __init__(self, model: TopologyModel, queue_size: int = 1000):
+        self.model = model
+        self.queue_size = queue_size
+        self.clients: Dict[Any, asyncio.Queue] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        model.add_listener(self.publish)
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def publish(self, delta: dict):
+        if not self.clients or self.loop is None:
+            return
+        text = json.dumps(delta, ensure_ascii=False)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._fanout(text)
+        else:
+            self.loop.call_soon_threadsafe(self._fanout, text)
+
+    def _fanout(self, text: str):
+        for queue in list(self.clients.values()):
+            try:
+                queue.put_nowait(text)
+            except asyncio.QueueFull:
+                self._request_resync(queue)
+
+    def _request_resync(self, queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(self._RESYNC)
+
+    def _snapshot_message(self, fmt: str) -> str:
+        # Se envuelve el JSON ya serializado del modelo sin volver a codificarlo
+        return '{"type": "snapshot", "topology": ' + self.model.snapshot_json(fmt).decode('utf-8') + '}'
+
+    async def serve(self, websocket, fmt: str = "pairs"):
+        """Atiende un cliente hasta que se desconecte"""
+        await websocket.accept()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        # Registrar antes del snapshot: los deltas con versión <= snapshot los descarta el cliente
+        self.clients[websocket] = queue
+        queue.put_nowait(self._RESYNC)
+
+        async def writer():
+            while True:
+                item = await queue.get()
+                text = self._snapshot_message(fmt) if item is self._RESYNC else item
+                await websocket.send_text(text)
+
+        async def reader():
+            while True:
+                message = await websocket.receive_text()
+                try:
+                    data = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                # El cliente detectó un hueco de versiones
+                if data.get("type") == "resync":
+                    self._request_resync(queue)
+
+        tasks = [asyncio.create_task(writer()), asyncio.create_task(reader())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.clients.pop(websocket, None)
@@ -0,0 +1,174 @@
+"""
+Traffic - Pipeline de ingesta de eventos de tráfico
+Los endpoints validan y encolan lotes de eventos y responden de inmediato;
+una tarea de fondo entrega los lotes a los consumidores (broadcast SCADA, ...)
+"""
+
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import inspect
+import math
+
+
+class TrafficValidationError(ValueError):
+    """Evento de tráfico con campos inválidos"""
+
+
+def _optional_str(raw: dict, key: str) -> Optional[str]:
+    value = raw.get(key)
+    if value is None or isinstance(value, str):
+        return value
+    raise TrafficValidationError(f"{key} must be a string")
+
+
+def _optional_number(raw: dict, key: str, cast):
+    value = raw.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise TrafficValidationError(f"{key} must be a number")
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise TrafficValidationError(f"{key} must be a number")
+    if isinstance(number, float) and not math.isfinite(number):
+        raise TrafficValidationError(f"{key} must be finite")
+    if cast is int and isinstance(value, float) and value != number:
+        raise TrafficValidationError(f"{key} must be an integer")
+    return number
+
+
+def normalize_event(raw: Any, timestamp: Optional[str] = None) -> dict:
+    """Valida un evento con los campos de TrafficEvent y lo convierte al formato del WebSocket"""
+    if not isinstance(raw, dict):
+        raise TrafficValidationError("event must be an object")
+
+    from_service = raw.get("from_service")
+    to_service = raw.get("to_service")
+    if not isinstance(from_service, str) or not isinstance(to_service, str):
+        raise TrafficValidationError("from_service and to_service are required strings")
+
+    method = raw.get("method", "HTTP")
+    if not isinstance(method, str):
+        raise TrafficValidationError("method must be a string")
+
+    path = _optional_str(raw, "path")
+    status = _optional_number(raw, "status", int)
+    # Fuera de rango no es un código HTTP y no cabe en las columnas u2 del historial/log
+    if status is not None and not 100 <= status <= 599:
+        raise TrafficValidationError("status must be an HTTP status code (100-599)")
+    duration = _optional_number(raw, "duration", float)
+
+    return {
+        "type": "request",
+        "from": from_service,
+        "to": to_service,
+        "method": method,
+        "path": path or "/",
+        "status": status or 200,
+        "duration": duration or 0,
+        "timestamp": _optional_str(raw, "timestamp") or timestamp or datetime.now().isoformat(),
+    }
+
+
+def status_class(status) -> str:
+    """Clase de un código HTTP: 1xx..5xx u 'other'"""
+    if isinstance(status, int) and 100 <= status < 600:
+        return f"{status // 100}xx"
+    return "other"
+
+
+def normalize_batch(raw_events: Iterable[Any]) -> Tuple[List[dict], int]:
+    """Valida un lote completo; devuelve (eventos válidos, número de rechazados)"""
+    timestamp = datetime.now().isoformat()
+    events = []
+    rejected = 0
+    for raw in raw_events:
+        try:
+            events.append(normalize_event(raw, timestamp))
+        except TrafficValidationError:
+            rejected += 1
+    return events, rejected
+
+
+class TrafficPipeline:
+    """Cola acotada de lotes de eventos y tarea que los entrega a los sinks.
+
+    submit() nunca espera: si la cola está llena, los eventos sobrantes se
+    descartan y se cuentan como dropped.
+    """
+
+    def __init__(self, max_pending: int = 100_000, max_batch: int = 5_000):
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending = 0
+        self._sinks: List[Callable[[List[dict]], Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.delivered = 0
+
+    def add_sink(self, sink: Callable[[List[dict]], Any]):
+        """Registra un consumidor de lotes (función o corrutina)"""
+        self._sinks.append(sink)
+
+    def submit(self, events: List[dict], rejected: int = 0) -> dict:
+        """Encola eventos ya validados y devuelve los contadores del envío"""
+        room = max(0, self.max_pending - self._pending)
+        if len(events) > room:
+            dropped = len(events) - room
+            events = events[:room]
+        else:
+            dropped = 0
+
+        if events:
+            self._queue.put_nowait(events)
+            self._pending += len(events)
+
+        self.accepted += len(events)
+        self.rejected += rejected
+        self.dropped += dropped
+        return {"accepted": len(events), "rejected": rejected, "dropped": dropped}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            batch = await self._queue.get()
+            # Agrupar lo que ya esté encolado para entregar lotes grandes
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch = batch + self._queue.get_nowait()
+            self._pending -= len(batch)
+
+            for sink in self._sinks:
+                try:
+                    result = sink(batch)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    print(f"Error en sink de tráfico: {e}")
+            self.delivered += len(batch)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "delivered": self.delivered,
+        }
@@ -0,0 +1,165 @@
+"""
+Traffic Anomalies - Detección online de anomalías de latencia y errores por arista
+Cada arista mantiene una línea base EWMA/EWMVar lenta y una EWMA rápida de la
+log-latencia y del indicador de error (5xx); el z-score de la media rápida
+frente a la línea base se actualiza en O(1) por evento
+"""
+
+from typing import Deque, List, Optional
+from collections import OrderedDict, deque
+import math
+import threading
+import time
+
+# metric -> desviación estándar mínima de la línea base: evita alertas por
+# variaciones ínfimas cuando el tráfico es muy estable
+METRICS = {
+    "latency": 0.1,   # log(1 + ms): ~10 % de variación
+    "errors": 0.25,   # indicador 0/1: un error aislado no basta para alertar
+}
+
+
+class MetricState:
+    """Línea base lenta (media y varianza exponenciales) y media rápida de una métrica"""
+
+    __slots__ = ("mean", "var", "fast", "active", "since")
+
+    def __init__(self, value: float):
+        self.mean = value
+        self.var = 0.0
+        self.fast = value
+        self.active = False
+        self.since = 0.0
+
+    def update(self, value: float, alpha: float, fast_alpha: float):
+        diff = value - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.var = (1 - alpha) * (self.var + diff * increment)
+        self.fast += fast_alpha * (value - self.fast)
+
+
+class EdgeState:
+    __slots__ = ("count", "metrics", "last_seen")
+
+    def __init__(self):
+        self.count = 0
+        self.metrics = {}
+        self.last_seen = 0.0
+
+
+class AnomalyDetector:
+    """Detector de regresiones por arista (from, to) alimentado por el pipeline de tráfico.
+
+    Una métrica entra en anomalía cuando el z-score de su media rápida supera
+    threshold (solo hacia arriba: más latencia o más errores) y sale cuando baja
+    de la mitad. La varianza de una EWMA con factor a sobre datos de varianza
+    s² es s²·a/(2-a), que es la que normaliza el z-score. Las aristas están
+    acotadas a max_edges (LRU) y el historial a max_history anomalías.
+    """
+
+    def __init__(self, threshold: float = 4.0, alpha: float = 0.01, fast_alpha: float = 0.1,
+                 warmup: int = 100, max_edges: int = 10_000, max_history: int = 500):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.fast_alpha = fast_alpha
+        self.warmup = warmup
+        self.max_edges = max_edges
+        self._fast_scale = math.sqrt(fast_alpha / (2 - fast_alpha))
+        self._lock = threading.Lock()
+        self._edges: "OrderedDict[tuple, EdgeState]" = OrderedDict()
+        self.recent: Deque[dict] = deque(maxlen=max_history)
+        self.detected = 0
+
+    def _z(self, state: MetricState, min_std: float) -> float:
+        std = max(math.sqrt(state.var), min_std) * self._fast_scale
+        return (state.fast - state.mean) / std
+
+    def record(self, events: List[dict]) -> List[dict]:
+        """Actualiza las líneas base con un lote; devuelve los cambios de estado (anomalía / resuelta)"""
+        now = time.time()
+        changes = []
+        with self._lock:
+            for event in events:
+                source, target = event.get("from"), event.get("to")
+                if not source or not target:
+                    continue
+                key = (source, target)
+                edge = self._edges.get(key)
+                if edge is None:
+                    edge = self._edges[key] = EdgeState()
+                    if len(self._edges) > self.max_edges:
+                        self._edges.popitem(last=False)
+                else:
+                    self._edges.move_to_end(key)
+                edge.count += 1
+                edge.last_seen = now
+
+                values = {
+                    "latency": math.log1p(max(event.get("duration") or 0, 0)),
+                    "errors": 1.0 if (event.get("status") or 0) >= 500 else 0.0,
+                }
+                for metric, value in values.items():
+                    state = edge.metrics.get(metric)
+                    if state is None:
+                        edge.metrics[metric] = MetricState(value)
+                        continue
+                    state.update(value, self.alpha, self.fast_alpha)
+                    if edge.count < self.warmup:
+                        continue
+                    z = self._z(state, METRICS[metric])
+                    if not state.active and z > self.threshold:
+                        state.active, state.since = True, now
+                        changes.append(self._change("anomaly", key, metric, state, z, now))
+                    elif state.active and z < self.threshold / 2:
+                        state.active = False
+                        changes.append(self._change("anomaly_resolved", key, metric, state, z, now))
+
+            for change in changes:
+                if change["type"] == "anomaly":
+                    self.recent.append(change)
+                    self.detected += 1
+        return changes
+
+    @staticmethod
+    def _values(metric: str, state: MetricState):
+        """(actual, línea base) en unidades legibles: ms o tasa de errores"""
+        if metric == "latency":
+            return round(math.expm1(state.fast), 2), round(math.expm1(state.mean), 2)
+        return round(state.fast, 4), round(state.mean, 4)
+
+    def _change(self, kind: str, key: tuple, metric: str, state: MetricState, z: float, now: float) -> dict:
+        current, baseline = self._values(metric, state)
+        return {
+            "type": kind,
+            "from": key[0],
+            "to": key[1],
+            "metric": metric,
+            "z": round(z, 2),
+            "value": current,
+            "baseline": baseline,
+            "since": state.since,
+            "timestamp": now,
+        }
+
+    def active(self) -> List[dict]:
+        """Anomalías abiertas en este momento"""
+        with self._lock:
+            return [
+                {"from": key[0], "to": key[1], "metric": metric, "since": state.since,
+                 "z": round(self._z(state, METRICS[metric]), 2),
+                 **dict(zip(("value", "baseline"), self._values(metric, state)))}
+                for key, edge in self._edges.items()
+                for metric, state in edge.metrics.items()
+                if state.active
+            ]
+
+    def history(self, limit: int = 100, since: Optional[float] = None) -> List[dict]:
+        """Últimas anomalías detectadas, de la más reciente a la más antigua"""
+        with self._lock:
+            items = [a for a in reversed(self.recent) if since is None or a["timestamp"] >= since]
+        return items[:limit]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"edges": len(self._edges), "detected": self.detected}
@@ -0,0 +1,108 @@
+"""
+Traffic Edges - Dependencias entre servicios observadas en el tráfico
+Cada arista (from, to) vista en eventos de tráfico lleva tasa de requests,
+tasa de errores y latencia mediana; expira tras un tiempo sin tráfico y el
+número de aristas está acotado
+"""
+
+from typing import List, Optional
+from collections import OrderedDict
+import threading
+import time
+
+from traffic_stats import RollingWindow, histogram_percentile, latency_bucket
+
+# Nombres más largos se recortan: el tamaño de cada clave también queda acotado
+MAX_NAME_LENGTH = 256
+
+
+class TrafficEdge:
+    """Ventana deslizante y última actividad de una arista"""
+
+    __slots__ = ("window", "last_seen")
+
+    def __init__(self, window_seconds: int):
+        self.window = RollingWindow(window_seconds, 12)
+        self.last_seen = 0.0
+
+
+class TrafficEdgeStore:
+    """Aristas inferidas del tráfico, alimentadas por el pipeline de tráfico.
+
+    Las aristas sin tráfico durante idle_seconds se eliminan en expire(); si
+    hay más de max_edges se descarta la usada hace más tiempo (LRU), así los
+    nombres de servicio de alta cardinalidad no hacen crecer la memoria.
+    """
+
+    def __init__(self, max_edges: int = 5000, idle_seconds: float = 300, window_seconds: int = 60):
+        self.max_edges = max_edges
+        self.idle_seconds = idle_seconds
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        # (from, to) -> TrafficEdge, en orden de uso
+        self._edges: "OrderedDict[tuple, TrafficEdge]" = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    def record(self, events: List[dict]):
+        """Sink del pipeline: actualiza las aristas de un lote de eventos"""
+        now = time.time()
+        with self._lock:
+            for event in events:
+                source, target = event.get("from"), event.get("to")
+                if not source or not target or source == target:
+                    continue
+                key = (source[:MAX_NAME_LENGTH], target[:MAX_NAME_LENGTH])
+                edge = self._edges.get(key)
+                if edge is None:
+                    edge = self._edges[key] = TrafficEdge(self.window_seconds)
+                    if len(self._edges) > self.max_edges:
+                        self._edges.popitem(last=False)
+                        self.evicted += 1
+                else:
+                    self._edges.move_to_end(key)
+                duration = event.get("duration") or 0
+                edge.window.add(now, (event.get("status") or 0) >= 500, duration, latency_bucket(duration))
+                edge.last_seen = now
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Elimina las aristas inactivas; devuelve cuántas se eliminaron"""
+        cutoff = (now or time.time()) - self.idle_seconds
+        removed = 0
+        with self._lock:
+            # Orden LRU: las inactivas están al principio
+            while self._edges:
+                key, edge = next(iter(self._edges.items()))
+                if edge.last_seen >= cutoff:
+                    break
+                del self._edges[key]
+                removed += 1
+            self.expired += removed
+        return removed
+
+    def edges(self, now: Optional[float] = None) -> List[dict]:
+        """Aristas vigentes con sus métricas sobre la ventana, ordenadas por (from, to)"""
+        now = now or time.time()
+        result = []
+        with self._lock:
+            for (source, target), edge in self._edges.items():
+                count, errors, _, histogram, minimum, maximum = edge.window.merged(now)
+                result.append({
+                    "source": source,
+                    "target": target,
+                    "rate_per_s": round(count / self.window_seconds, 3),
+                    "error_rate": round(errors / count, 4) if count else 0.0,
+                    "p50_ms": histogram_percentile(histogram, count, 50, minimum, maximum),
+                    "last_seen": round(edge.last_seen, 3),
+                })
+        result.sort(key=lambda edge: (edge["source"], edge["target"]))
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "edges": len(self._edges),
+                "max_edges": self.max_edges,
+                "evicted": self.evicted,
+                "expired": self.expired,
+            }
@@ -0,0 +1,285 @@
+"""
+Traffic History - Serie temporal columnar del tráfico en memoria
+Anillos de columnas NumPy de capacidad fija para los eventos crudos y sus
+rollups a 10s, 1m y 1h; las consultas por rango son operaciones vectorizadas
+"""
+
+from typing import Dict, List, Optional, Tuple
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Resoluciones de los rollups (segundos) y reparto del presupuesto de memoria
+ROLLUP_STEPS = (10, 60, 3600)
+MEMORY_SHARES = {"raw": 0.70, 10: 0.15, 60: 0.10, 3600: 0.05}
+
+# Arista reservada para las que exceden max_edges
+OTHER_EDGE = ("(other)", "(other)")
+
+RAW_COLUMNS = (("ts", "f8"), ("edge", "u2"), ("status", "u2"), ("duration", "f4"))
+ROLLUP_COLUMNS = (("ts", "f8"), ("edge", "u2"), ("count", "u4"), ("errors", "u4"),
+                  ("duration_sum", "f8"), ("duration_max", "f4"))
+
+
+class ColumnRing:
+    """Columnas NumPy de capacidad fija; al llenarse se sobrescriben las filas más viejas"""
+
+    def __init__(self, columns, capacity: int):
+        self.capacity = max(1, capacity)
+        self.columns = {name: np.zeros(self.capacity, dtype=dtype) for name, dtype in columns}
+        self.head = 0  # próxima posición de escritura
+        self.size = 0
+
+    @staticmethod
+    def row_bytes(columns) -> int:
+        return sum(np.dtype(dtype).itemsize for _, dtype in columns)
+
+    def append(self, **values):
+        n = len(values["ts"])
+        if n == 0:
+            return
+        if n > self.capacity:
+            values = {name: array[-self.capacity:] for name, array in values.items()}
+            n = self.capacity
+        first = min(n, self.capacity - self.head)
+        for name, array in values.items():
+            column = self.columns[name]
+            column[self.head:self.head + first] = array[:first]
+            column[:n - first] = array[first:]
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.capacity, self.size + n)
+
+    def view(self) -> Dict[str, "np.ndarray"]:
+        """Filas vigentes en orden de inserción (copias)"""
+        if self.size < self.capacity:
+            return {name: column[:self.size].copy() for name, column in self.columns.items()}
+        return {name: np.concatenate((column[self.head:], column[:self.head])) for name, column in self.columns.items()}
+
+    def oldest(self) -> Optional[float]:
+        if not self.size:
+            return None
+        return float(self.columns["ts"][0 if self.size < self.capacity else self.head])
+
+
+class RollupTier:
+    """Rollup a una resolución fija: acumula buckets abiertos y guarda los cerrados en un anillo"""
+
+    def __init__(self, step: int, capacity: int):
+        self.step = step
+        self.ring = ColumnRing(ROLLUP_COLUMNS, capacity)
+        # (inicio del bucket, arista) -> [count, errors, suma, máximo]
+        self._open: Dict[Tuple[float, int], list] = {}
+
+    def add(self, ts, edge, count, errors, duration_sum, duration_max):
+        """Agrega filas (arrays) a los buckets abiertos de esta resolución"""
+        buckets = np.floor(ts / self.step) * self.step
+        keys = np.stack((buckets, edge.astype("f8")), axis=1)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, weights=count)
+        error_counts = np.bincount(inverse, weights=errors)
+        sums = np.bincount(inverse, weights=duration_sum)
+        maxima = np.full(len(unique), -np.inf)
+        np.maximum.at(maxima, inverse, duration_max)
+
+        for i, (bucket, edge_id) in enumerate(unique):
+            key = (float(bucket), int(edge_id))
+            entry = self._open.get(key)
+            if entry is None:
+                self._open[key] = [counts[i], error_counts[i], sums[i], maxima[i]]
+            else:
+                entry[0] += counts[i]
+                entry[1] += error_counts[i]
+                entry[2] += sums[i]
+                entry[3] = max(entry[3], maxima[i])
+
+    def close(self, watermark: float) -> Optional[Dict[str, "np.ndarray"]]:
+        """Mueve al anillo los buckets que terminaron antes de watermark y los devuelve"""
+        closed = sorted(key for key in self._open if key[0] + self.step <= watermark)
+        if not closed:
+            return None
+        entries = [self._open.pop(key) for key in closed]
+        rows = {
+            "ts": np.array([key[0] for key in closed], dtype="f8"),
+            "edge": np.array([key[1] for key in closed], dtype="u2"),
+            "count": np.array([e[0] for e in entries], dtype="u4"),
+            "errors": np.array([e[1] for e in entries], dtype="u4"),
+            "duration_sum": np.array([e[2] for e in entries], dtype="f8"),
+            "duration_max": np.array([e[3] for e in entries], dtype="f4"),
+        }
+        self.ring.append(**rows)
+        return rows
+
+    def open_rows(self) -> Dict[str, "np.ndarray"]:
+        """Buckets aún abiertos (todavía no propagados a la resolución siguiente)"""
+        keys = sorted(self._open)
+        entries = [self._open[key] for key in keys]
+        return {
+            "ts": np.array([key[0] for key in keys], dtype="f8"),
+            "edge": np.array([key[1] for key in keys], dtype="u2"),
+            "count": np.array([e[0] for e in entries], dtype="u4"),
+            "errors": np.array([e[1] for e in entries], dtype="u4"),
+            "duration_sum": np.array([e[2] for e in entries], dtype="f8"),
+            "duration_max": np.array([e[3] for e in entries], dtype="f4"),
+        }
+
+
+class TrafficHistory:
+    """Historial del tráfico con memoria acotada por max_bytes.
+
+    Los eventos crudos van a un anillo columnar (timestamp, arista, status,
+    duración) y se resumen en rollups de 10s que alimentan los de 1m, y estos
+    los de 1h; cada resolución retiene tanto tiempo como le permita su parte
+    del presupuesto.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_edges: int = 65535):
+        if np is None:
+            raise RuntimeError("NumPy no está instalado")
+        self._lock = threading.Lock()
+        self.max_edges = min(max_edges, 65535)
+        # (from, to) <-> id de arista (uint16); el 0 agrupa las que exceden el límite
+        self._edge_ids: Dict[tuple, int] = {OTHER_EDGE: 0}
+        self._edges: List[tuple] = [OTHER_EDGE]
+
+        raw_row = ColumnRing.row_bytes(RAW_COLUMNS)
+        rollup_row = ColumnRing.row_bytes(ROLLUP_COLUMNS)
+        self.raw = ColumnRing(RAW_COLUMNS, int(max_bytes * MEMORY_SHARES["raw"]) // raw_row)
+        self.tiers = [RollupTier(step, int(max_bytes * MEMORY_SHARES[step]) // rollup_row) for step in ROLLUP_STEPS]
+        self.max_bytes = max_bytes
+
+    def _edge_id(self, source, target) -> int:
+        key = (source, target)
+        edge_id = self._edge_ids.get(key)
+        if edge_id is None:
+            if len(self._edges) > self.max_edges:
+                return 0
+            edge_id = self._edge_ids[key] = len(self._edges)
+            self._edges.append(key)
+        return edge_id
+
+    def record(self, events: List[dict]):
+        """Sink del pipeline: agrega un lote de eventos con la hora de ingesta"""
+        if not events:
+            return
+        now = time.time()
+        with self._lock:
+            n = len(events)
+            ts = np.full(n, now, dtype="f8")
+            edge = np.fromiter((self._edge_id(e.get("from"), e.get("to")) for e in events), dtype="u2", count=n)
+            status = np.fromiter((e.get("status") or 0 for e in events), dtype="u2", count=n)
+            duration = np.fromiter((e.get("duration") or 0 for e in events), dtype="f4", count=n)
+            self.raw.append(ts=ts, edge=edge, status=status, duration=duration)
+
+            # Rollup de 10s desde los eventos; los cerrados alimentan la resolución siguiente
+            self.tiers[0].add(ts, edge, np.ones(n), (status >= 500).astype("f8"), duration.astype("f8"), duration)
+            self._close_tiers(now)
+
+    def _close_tiers(self, now: float):
+        for tier, coarser in zip(self.tiers, self.tiers[1:] + [None]):
+            closed = tier.close(now)
+            if closed is not None and coarser is not None:
+                coarser.add(closed["ts"], closed["edge"], closed["count"].astype("f8"),
+                            closed["errors"].astype("f8"), closed["duration_sum"], closed["duration_max"])
+
+    def _select_source(self, start: float, step: float):
+        """Resolución más gruesa que divida a step y que cubra el inicio del rango"""
+        candidates = [tier for tier in reversed(self.tiers) if step % tier.step == 0]
+        for tier in candidates:
+            oldest = tier.ring.oldest()
+            if oldest is not None and oldest <= start:
+                return tier
+        raw_oldest = self.raw.oldest()
+        if (raw_oldest is not None and raw_oldest <= start) or not candidates:
+            return None
+        # Ninguna cubre el rango completo: la más gruesa es la que retiene más historia
+        return candidates[0]
+
+    def _tier_rows(self, tier: RollupTier) -> Dict[str, "np.ndarray"]:
+        """Filas de una resolución más lo que sigue abierto en ella y en las más finas"""
+        parts = [tier.ring.view()]
+        for other in self.tiers[:self.tiers.index(tier) + 1]:
+            if other._open:
+                parts.append(other.open_rows())
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    def query(self, start: float, end: float, step: float,
+              source: Optional[str] = None, target: Optional[str] = None) -> dict:
+        """Serie [start, end) agregada cada step segundos (conteo, errores, latencia media y máxima).
+
+        Con una resolución de rollup, start se alinea a su paso para que cada
+        bucket caiga entero en un punto de la serie.
+        """
+        with self._lock:
+            self._close_tiers(time.time())
+            tier = self._select_source(start, step)
+            if tier is None:
+                rows = self.raw.view()
+                count = np.ones(len(rows["ts"]))
+                errors = (rows["status"] >= 500).astype("f8")
+                duration_sum = rows["duration"].astype("f8")
+                duration_max = rows["duration"]
+                resolution = "raw"
+            else:
+                start = float(np.floor(start / tier.step) * tier.step)
+                rows = self._tier_rows(tier)
+                count = rows["count"].astype("f8")
+                errors = rows["errors"].astype("f8")
+                duration_sum = rows["duration_sum"]
+                duration_max = rows["duration_max"]
+                resolution = f"{tier.step}s"
+            edge_filter = None
+            if source is not None or target is not None:
+                edge_filter = np.array([
+                    i for i, (s, t) in enumerate(self._edges)
+                    if (source is None or s == source) and (target is None or t == target)
+                ], dtype="u2")
+
+        mask = (rows["ts"] >= start) & (rows["ts"] < end)
+        if edge_filter is not None:
+            mask &= np.isin(rows["edge"], edge_filter)
+
+        points = int(np.ceil((end - start) / step))
+        index = ((rows["ts"][mask] - start) // step).astype(np.int64)
+        counts = np.bincount(index, weights=count[mask], minlength=points)[:points]
+        error_counts = np.bincount(index, weights=errors[mask], minlength=points)[:points]
+        sums = np.bincount(index, weights=duration_sum[mask], minlength=points)[:points]
+        maxima = np.zeros(points)
+        if index.size:
+            np.maximum.at(maxima, index, duration_max[mask].astype("f8"))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.where(counts > 0, sums / counts, 0.0)
+
+        columns = zip(
+            (start + np.arange(points) * step).tolist(),
+            counts.astype(np.int64).tolist(),
+            error_counts.astype(np.int64).tolist(),
+            np.round(averages, 2).tolist(),
+            np.round(maxima, 2).tolist(),
+        )
+        return {
+            "from": start,
+            "to": end,
+            "step": step,
+            "resolution": resolution,
+            "points": [
+                {"t": t, "count": c, "errors": e, "avg_ms": avg, "max_ms": peak}
+                for t, c, e, avg, peak in columns
+            ],
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "edges": len(self._edges) - 1,
+                "raw": {"rows": self.raw.size, "capacity": self.raw.capacity, "oldest": self.raw.oldest()},
+                "rollups": {
+                    f"{tier.step}s": {"rows": tier.ring.size, "capacity": tier.ring.capacity, "oldest": tier.ring.oldest()}
+                    for tier in self.tiers
+                },
+            }
@@ -0,0 +1,351 @@
+"""
+Traffic Log - Registro persistente del tráfico en segmentos binarios
+Log append-only en disco con retención por tamaño y antigüedad; la lectura
+usa mmap y un índice disperso (timestamp -> offset) por segmento para saltar
+directamente al inicio del rango pedido
+"""
+
+from typing import Iterator, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"KTL1"
+# Registro: timestamp de ingesta (f8), status (u2), duración ms (f4), largo del payload (u2)
+RECORD = struct.Struct("<dHfH")
+# Payload: from, to, method y path en UTF-8 separados por \0
+SEPARATOR = b"\x00"
+MAX_PAYLOAD = 0xFFFF
+# Entrada del índice: timestamp (f8), offset del primer registro con ese timestamp (u8)
+INDEX_ENTRY = struct.Struct("<dQ")
+
+
+def _encode(event: dict) -> bytes:
+    fields = [
+        str(event.get(key) or "").replace("\x00", "").encode("utf-8")
+        for key in ("from", "to", "method", "path")
+    ]
+    payload = SEPARATOR.join(fields)
+    if len(payload) > MAX_PAYLOAD:
+        # Sólo el path puede ser arbitrariamente largo: se recorta
+        head = SEPARATOR.join(fields[:3]) + SEPARATOR
+        payload = head + fields[3][:MAX_PAYLOAD - len(head)]
+    return payload
+
+
+def _decode(ts: float, status: int, duration: float, payload: bytes) -> dict:
+    source, target, method, path = payload.decode("utf-8", "replace").split("\x00", 3)
+    return {
+        "type": "request",
+        "from": source,
+        "to": target,
+        "method": method,
+        "path": path or "/",
+        "status": status,
+        "duration": round(duration, 3),
+        "timestamp": datetime.fromtimestamp(ts).isoformat(),
+    }
+
+
+class Segment:
+    """Un archivo de segmento (.log) y su índice disperso (.idx)"""
+
+    def __init__(self, directory: str, start: float):
+        self.start = start
+        name = f"traffic-{int(start * 1000):015d}"
+        self.path = os.path.join(directory, name + ".log")
+        self.index_path = os.path.join(directory, name + ".idx")
+        self.index_ts: List[float] = []
+        self.index_offsets: List[int] = []
+        self.size = 0
+        self.last_ts: Optional[float] = None
+
+    @classmethod
+    def load(cls, directory: str, filename: str) -> 'Segment':
+        """Segmento existente; reconstruye el índice escaneando el log si falta o está truncado"""
+        segment = cls(directory, int(filename[len("traffic-"):-len(".log")]) / 1000)
+        segment.size = os.path.getsize(segment.path)
+        if os.path.exists(segment.index_path):
+            with open(segment.index_path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for ts, offset in INDEX_ENTRY.iter_unpack(data[:usable]):
+                if offset < segment.size:
+                    segment.index_ts.append(ts)
+                    segment.index_offsets.append(offset)
+        if not segment.index_ts:
+            segment._rebuild_index()
+        if segment.index_ts:
+            segment.last_ts = segment.index_ts[-1]
+        return segment
+
+    def _rebuild_index(self):
+        last = None
+        for offset, ts, _, _, _ in self.records(len(MAGIC)):
+            if ts != last:
+                self.index_ts.append(ts)
+                self.index_offsets.append(offset)
+                last = ts
+        with open(self.index_path, "wb") as f:
+            for ts, offset in zip(self.index_ts, self.index_offsets):
+                f.write(INDEX_ENTRY.pack(ts, offset))
+
+    def seek(self, ts: float) -> int:
+        """Offset desde el que leer para no perder registros con timestamp >= ts"""
+        i = bisect.bisect_right(self.index_ts, ts) - 1
+        return self.index_offsets[i] if i >= 0 else len(MAGIC)
+
+    def records(self, offset: int, length: Optional[int] = None) -> Iterator[Tuple[int, float, int, float, bytes]]:
+        """(offset, ts, status, duración, payload) desde offset leyendo el archivo por mmap.
+
+        length limita la lectura a los bytes ya escritos (segmento activo); un
+        registro truncado al final (caída a mitad de escritura) se ignora.
+        """
+        length = self.size if length is None else length
+        if length <= offset:
+            return
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ) as data:
+                while offset + RECORD.size <= length:
+                    ts, status, duration, payload_len = RECORD.unpack_from(data, offset)
+                    end = offset + RECORD.size + payload_len
+                    if end > length:
+                        return
+                    yield offset, ts, status, duration, data[offset + RECORD.size:end]
+                    offset = end
+
+
+class TrafficLogReader:
+    """Lectura por lotes de un rango del log, pensada para avanzar desde hilos.
+
+    next_batch() bloquea (usar con asyncio.to_thread); close() no bloquea y
+    puede llamarse desde el event loop mientras otro hilo está leyendo: en
+    ese caso el hilo lector libera el mmap y el archivo al terminar el lote.
+    """
+
+    def __init__(self, batches: Iterator[List[Tuple[float, dict]]]):
+        self._batches = batches
+        self._state = threading.Lock()
+        self._reading = False
+        self._closed = False
+
+    def next_batch(self) -> Optional[List[Tuple[float, dict]]]:
+        """Siguiente lote, o None al terminar el rango o tras close()"""
+        with self._state:
+            if self._closed:
+                return None
+            self._reading = True
+        try:
+            batch = next(self._batches, None)
+        finally:
+            with self._state:
+                self._reading = False
+                closed = self._closed
+        if closed:
+            self._batches.close()
+            return None
+        return batch
+
+    def close(self):
+        with self._state:
+            self._closed = True
+            if self._reading:
+                return  # lo cierra el hilo lector al terminar
+        self._batches.close()
+
+
+class TrafficLog:
+    """Log de tráfico segmentado, alimentado por el pipeline de tráfico.
+
+    Cada lote se escribe al final del segmento activo con su hora de ingesta,
+    así los timestamps del log son crecientes y el índice sirve para buscar.
+    El segmento rota al superar segment_bytes o segment_seconds; los segmentos
+    cerrados más viejos se borran cuando el total excede max_bytes o quedan
+    fuera de max_age.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 segment_seconds: float = 3600, max_bytes: int = 1024 * 1024 * 1024,
+                 max_age: float = 72 * 3600, index_interval: float = 1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.index_interval = index_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._index_file = None
+        self.written = 0
+        self.deleted_segments = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments: List[Segment] = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.startswith("traffic-") and filename.endswith(".log"):
+                try:
+                    self.segments.append(Segment.load(directory, filename))
+                except (OSError, ValueError) as e:
+                    print(f"⚠️  Segmento de tráfico ilegible {filename}: {e}")
+        # Tras un reinicio siempre se abre un segmento nuevo: los anteriores quedan cerrados
+        self.active: Optional[Segment] = None
+
+    def _open_segment(self, now: float):
+        self._close_files()
+        segment = Segment(self.directory, now)
+        self._file = open(segment.path, "ab")
+        self._index_file = open(segment.index_path, "ab")
+        self._file.write(MAGIC)
+        segment.size = len(MAGIC)
+        self.segments.append(segment)
+        self.active = segment
+        self._enforce_retention(now)
+
+    def _close_files(self):
+        for f in (self._file, self._index_file):
+            if f is not None:
+                f.close()
+        self._file = self._index_file = None
+        self.active = None
+
+    def _enforce_retention(self, now: float):
+        """Borra los segmentos cerrados más viejos que excedan tamaño o antigüedad"""
+        total = sum(segment.size for segment in self.segments)
+        while len(self.segments) > 1:
+            oldest, following = self.segments[0], self.segments[1]
+            # Un segmento termina donde empieza el siguiente
+            if total <= self.max_bytes and following.start >= now - self.max_age:
+                break
+            for path in (oldest.path, oldest.index_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= oldest.size
+            self.segments.pop(0)
+            self.deleted_segments += 1
+
+    def append(self, events: List[dict]):
+        """Escribe un lote de eventos (bloqueante: usar desde un hilo)"""
+        if not events:
+            return
+        now = time.time()
+        chunks = []
+        for event in events:
+            payload = _encode(event)
+            chunks.append(RECORD.pack(now, min(int(event.get("status") or 0), 0xFFFF),
+                                      float(event.get("duration") or 0), len(payload)))
+            chunks.append(payload)
+        data = b"".join(chunks)
+
+        with self._lock:
+            active = self.active
+            if (active is None or active.size + len(data) > self.segment_bytes
+                    or now - active.start >= self.segment_seconds):
+                self._open_segment(now)
+                active = self.active
+            if active.last_ts is None or now - active.index_ts[-1] >= self.index_interval:
+                active.index_ts.append(now)
+                active.index_offsets.append(active.size)
+                self._index_file.write(INDEX_ENTRY.pack(now, active.size))
+                self._index_file.flush()
+            self._file.write(data)
+            self._file.flush()
+            active.size += len(data)
+            active.last_ts = now
+            self.written += len(events)
+
+    async def record(self, events: List[dict]):
+        """Sink del pipeline: la escritura a disco corre fuera del event loop"""
+        await asyncio.to_thread(self.append, events)
+
+    def read(self, start: float, end: float, batch_size: int = 1000) -> Iterator[List[Tuple[float, dict]]]:
+        """Lotes de (timestamp, evento) con start <= timestamp < end, en orden"""
+        with self._lock:
+            segments = list(self.segments)
+            # Del segmento activo sólo se lee lo ya escrito en este momento
+            limits = {id(segment): segment.size for segment in segments}
+        batch = []
+        for i, segment in enumerate(segments):
+            following = segments[i + 1].start if i + 1 < len(segments) else None
+            if segment.start >= end or (following is not None and following <= start):
+                continue
+            try:
+                for _, ts, status, duration, payload in segment.records(segment.seek(start), limits[id(segment)]):
+                    if ts < start:
+                        continue
+                    if ts >= end:
+                        break
+                    batch.append((ts, _decode(ts, status, duration, payload)))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+            except (OSError, ValueError):
+                # Segmento borrado por la retención durante la lectura
+                continue
+        if batch:
+            yield batch
+
+    def reader(self, start: float, end: float, batch_size: int = 1000) -> TrafficLogReader:
+        """Como read(), pero con un lector que se puede cerrar desde otro hilo"""
+        return TrafficLogReader(self.read(start, end, batch_size))
+
+    async def replay(self, start: float, end: float, speed: float, frame_ms: float):
+        """Reproduce el rango a speed× la velocidad original en ventanas de frame_ms (tiempo real).
+
+        Genera (timestamp de inicio de la ventana en el log, eventos). El reloj
+        arranca en el primer evento del rango; los tramos sin tráfico entre
+        eventos se esperan igual, escalados por speed.
+        """
+        window = frame_ms / 1000 * speed
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        batches = self.reader(start, end)
+        origin, current, frame = None, None, []
+        try:
+            while True:
+                batch = await asyncio.to_thread(batches.next_batch)
+                if batch is None:
+                    break
+                for ts, event in batch:
+                    if origin is None:
+                        origin = ts
+                    slot = int((ts - origin) // window)
+                    if slot != current and frame:
+                        await self._wait_slot(loop, started, current, frame_ms)
+                        yield origin + current * window, frame
+                        frame = []
+                    current = slot
+                    frame.append(event)
+            if frame:
+                await self._wait_slot(loop, started, current, frame_ms)
+                yield origin + current * window, frame
+        finally:
+            batches.close()
+
+    @staticmethod
+    async def _wait_slot(loop, started: float, slot: int, frame_ms: float):
+        delay = started + (slot + 1) * frame_ms / 1000 - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "segments": len(self.segments),
+                "bytes": sum(segment.size for segment in self.segments),
+                "max_bytes": self.max_bytes,
+                "oldest": self.segments[0].start if self.segments else None,
+                "written": self.written,
+                "deleted_segments": self.deleted_segments,
+            }
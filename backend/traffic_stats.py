@@ -0,0 +1,217 @@
+"""
+Traffic Stats - Estadísticas de tráfico por arista en ventanas deslizantes
+Para cada arista (from, to) y cada (to, path) mantiene conteos, errores e
+histogramas de latencia en memoria fija para las ventanas 1m, 5m y 1h
+"""
+
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import bisect
+import threading
+import time
+
+# Límites superiores (ms) de los buckets del histograma de latencia: escala
+# geométrica (x1.25) de 0.5 ms a ~2 min; el último bucket recoge todo lo que exceda
+LATENCY_BOUNDS: List[float] = []
+_bound = 0.5
+while _bound < 120_000:
+    LATENCY_BOUNDS.append(round(_bound, 3))
+    _bound *= 1.25
+
+# ventana -> (duración en segundos, número de slots del anillo)
+WINDOWS: Dict[str, Tuple[int, int]] = {
+    "1m": (60, 12),
+    "5m": (300, 10),
+    "1h": (3600, 12),
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def latency_bucket(duration_ms: float) -> int:
+    return bisect.bisect_left(LATENCY_BOUNDS, duration_ms)
+
+
+def histogram_percentile(histogram: Dict[int, int], total: int, percentile: float,
+                         minimum: Optional[float] = None, maximum: Optional[float] = None) -> Optional[float]:
+    """Percentil aproximado: interpolación lineal dentro del bucket que lo contiene.
+
+    Con minimum/maximum (valores observados) el resultado se acota a ese rango:
+    la interpolación no puede reportar una latencia que nunca se vio.
+    """
+    if not total:
+        return None
+    rank = total * percentile / 100
+    seen = 0
+    value = LATENCY_BOUNDS[-1]
+    for bucket in sorted(histogram):
+        count = histogram[bucket]
+        if seen + count >= rank:
+            if bucket < len(LATENCY_BOUNDS):
+                lower = LATENCY_BOUNDS[bucket - 1] if bucket else 0.0
+                upper = LATENCY_BOUNDS[bucket]
+                value = lower + (upper - lower) * (rank - seen) / count
+            break
+        seen += count
+    if maximum is not None:
+        value = min(value, maximum)
+    if minimum is not None:
+        value = max(value, minimum)
+    return round(float(value), 2)
+
+
+class RollingWindow:
+    """Anillo de slots de duración fija; la ventana avanza de slot en slot.
+
+    Cada slot guarda [id de slot, conteo, errores, suma de latencias, histograma
+    disperso {bucket: conteo}, latencia mínima, latencia máxima], así la memoria
+    no depende del volumen de eventos.
+    """
+
+    __slots__ = ("slot_seconds", "slots")
+
+    def __init__(self, seconds: int, slot_count: int):
+        self.slot_seconds = seconds / slot_count
+        self.slots: List[Optional[list]] = [None] * slot_count
+
+    def add(self, now: float, is_error: bool, duration_ms: float, bucket: int):
+        slot_id = int(now // self.slot_seconds)
+        index = slot_id % len(self.slots)
+        slot = self.slots[index]
+        if slot is None or slot[0] != slot_id:
+            slot = self.slots[index] = [slot_id, 0, 0, 0.0, {}, duration_ms, duration_ms]
+        slot[1] += 1
+        if is_error:
+            slot[2] += 1
+        slot[3] += duration_ms
+        slot[4][bucket] = slot[4].get(bucket, 0) + 1
+        if duration_ms < slot[5]:
+            slot[5] = duration_ms
+        elif duration_ms > slot[6]:
+            slot[6] = duration_ms
+
+    def merged(self, now: float) -> Tuple[int, int, float, Dict[int, int], Optional[float], Optional[float]]:
+        """(conteo, errores, suma de latencias, histograma, mínima, máxima) de los slots vigentes"""
+        current = int(now // self.slot_seconds)
+        oldest = current - len(self.slots) + 1
+        count = errors = 0
+        total_ms = 0.0
+        histogram: Dict[int, int] = {}
+        minimum = maximum = None
+        for slot in self.slots:
+            if slot is None or slot[0] < oldest or slot[0] > current:
+                continue
+            count += slot[1]
+            errors += slot[2]
+            total_ms += slot[3]
+            for bucket, n in slot[4].items():
+                histogram[bucket] = histogram.get(bucket, 0) + n
+            minimum = slot[5] if minimum is None else min(minimum, slot[5])
+            maximum = slot[6] if maximum is None else max(maximum, slot[6])
+        return count, errors, total_ms, histogram, minimum, maximum
+
+
+class KeyStats:
+    """Ventanas 1m/5m/1h de una arista o de un (to, path)"""
+
+    __slots__ = ("windows", "last_seen")
+
+    def __init__(self):
+        self.windows = {name: RollingWindow(seconds, slots) for name, (seconds, slots) in WINDOWS.items()}
+        self.last_seen = 0.0
+
+    def add(self, now: float, is_error: bool, duration_ms: float):
+        bucket = latency_bucket(duration_ms)
+        for window in self.windows.values():
+            window.add(now, is_error, duration_ms, bucket)
+        self.last_seen = now
+
+    def summary(self, window: str, now: float) -> Optional[dict]:
+        count, errors, total_ms, histogram, minimum, maximum = self.windows[window].merged(now)
+        if not count:
+            return None
+        seconds = WINDOWS[window][0]
+        return {
+            "count": count,
+            "rate_per_s": round(count / seconds, 3),
+            "errors": errors,
+            "error_rate": round(errors / count, 4),
+            "latency_ms": {
+                "avg": round(total_ms / count, 2),
+                **{f"p{p}": histogram_percentile(histogram, count, p, minimum, maximum) for p in PERCENTILES},
+            },
+        }
+
+
+class TrafficStats:
+    """Motor de agregación alimentado por el pipeline de tráfico.
+
+    El número de claves por tipo está acotado (max_keys): al superarlo se
+    descarta la clave actualizada hace más tiempo.
+    """
+
+    def __init__(self, max_keys: int = 10_000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # (from, to) -> KeyStats y (to, path) -> KeyStats, en orden de uso (LRU)
+        self._edges: "OrderedDict[tuple, KeyStats]" = OrderedDict()
+        self._paths: "OrderedDict[tuple, KeyStats]" = OrderedDict()
+        self.evicted = 0
+
+    def _touch(self, table: "OrderedDict[tuple, KeyStats]", key: tuple) -> KeyStats:
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = KeyStats()
+            if len(table) > self.max_keys:
+                table.popitem(last=False)
+                self.evicted += 1
+        else:
+            table.move_to_end(key)
+        return stats
+
+    def record(self, events: List[dict]):
+        """Sink del pipeline: agrega un lote de eventos"""
+        now = time.time()
+        with self._lock:
+            for event in events:
+                status = event.get("status") or 0
+                is_error = status >= 500
+                duration = event.get("duration") or 0
+                source, target = event.get("from"), event.get("to")
+                self._touch(self._edges, (source, target)).add(now, is_error, duration)
+                self._touch(self._paths, (target, event.get("path") or "/")).add(now, is_error, duration)
+
+    def query(self, window: str = "5m", by: str = "edge", source: Optional[str] = None,
+              target: Optional[str] = None, limit: int = 100) -> dict:
+        """Claves con tráfico en la ventana, ordenadas por número de requests"""
+        now = time.time()
+        with self._lock:
+            if by == "edge":
+                rows = [
+                    ({"from": key[0], "to": key[1]}, stats)
+                    for key, stats in self._edges.items()
+                    if (source is None or key[0] == source) and (target is None or key[1] == target)
+                ]
+            else:
+                rows = [
+                    ({"to": key[0], "path": key[1]}, stats)
+                    for key, stats in self._paths.items()
+                    if target is None or key[0] == target
+                ]
+            results = []
+            for labels, stats in rows:
+                summary = stats.summary(window, now)
+                if summary is not None:
+                    results.append({**labels, **summary})
+
+        results.sort(key=lambda row: row["count"], reverse=True)
+        return {
+            "window": window,
+            "by": by,
+            "total": len(results),
+            "items": results[:limit],
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"edges": len(self._edges), "paths": len(self._paths), "evicted": self.evicted}
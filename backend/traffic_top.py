@@ -0,0 +1,147 @@
+"""
+Traffic Top - Endpoints más calientes del tráfico con memoria fija
+Resúmenes Space-Saving de (method, path) por servicio destino y de toda la
+flota, por número de requests, de errores (5xx) y por tiempo total de latencia
+"""
+
+from typing import Dict, List, Optional
+from collections import OrderedDict
+import heapq
+import threading
+
+# by -> unidad de los valores
+TOP_METRICS = {
+    "count": "requests",
+    "errors": "errors",
+    "latency": "ms",
+}
+
+
+class SpaceSaving:
+    """Top-K aproximado (Space-Saving) con a lo sumo capacity contadores.
+
+    Un elemento nuevo con la tabla llena reemplaza al de menor conteo y hereda
+    ese conteo como error máximo: el valor real está entre value - error y
+    value, y todo elemento con más de total/capacity está garantizado en la
+    tabla. El mínimo se busca en un heap con entradas perezosas.
+    """
+
+    __slots__ = ("capacity", "counts", "errors", "total", "_heap")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[tuple, float] = {}
+        self.errors: Dict[tuple, float] = {}
+        self.total = 0.0
+        # (conteo, elemento); las entradas cuyo conteo ya no coincide están obsoletas
+        self._heap: List[tuple] = []
+
+    def add(self, item: tuple, weight: float = 1.0):
+        if weight <= 0:
+            return
+        self.total += weight
+        counts = self.counts
+        if item in counts:
+            counts[item] += weight
+        elif len(counts) < self.capacity:
+            counts[item] = weight
+            self.errors[item] = 0.0
+        else:
+            while True:
+                value, victim = heapq.heappop(self._heap)
+                if counts.get(victim) == value:
+                    break
+            del counts[victim]
+            del self.errors[victim]
+            counts[item] = value + weight
+            self.errors[item] = value
+        heapq.heappush(self._heap, (counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(value, key) for key, value in counts.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, limit: int) -> List[tuple]:
+        """[(elemento, valor estimado, error máximo)] de mayor a menor"""
+        items = heapq.nlargest(limit, self.counts.items(), key=lambda kv: kv[1])
+        return [(item, value, self.errors[item]) for item, value in items]
+
+
+class TrafficTop:
+    """Heavy hitters del tráfico alimentados por el pipeline de tráfico.
+
+    Cada servicio destino tiene un resumen de capacity contadores por métrica
+    y la flota uno de fleet_capacity con clave (to, method, path); los destinos
+    se acotan a max_targets (LRU). La memoria no depende del número de paths
+    distintos (ids en la URL, etc.).
+    """
+
+    def __init__(self, capacity: int = 100, fleet_capacity: int = 1000, max_targets: int = 1000):
+        self.capacity = capacity
+        self.max_targets = max_targets
+        self._lock = threading.Lock()
+        self._fleet = {metric: SpaceSaving(fleet_capacity) for metric in TOP_METRICS}
+        # to -> {metric: SpaceSaving}, en orden de uso
+        self._targets: "OrderedDict[str, Dict[str, SpaceSaving]]" = OrderedDict()
+        self.evicted_targets = 0
+
+    def _target(self, target: str) -> Dict[str, SpaceSaving]:
+        sketches = self._targets.get(target)
+        if sketches is None:
+            sketches = self._targets[target] = {metric: SpaceSaving(self.capacity) for metric in TOP_METRICS}
+            if len(self._targets) > self.max_targets:
+                self._targets.popitem(last=False)
+                self.evicted_targets += 1
+        else:
+            self._targets.move_to_end(target)
+        return sketches
+
+    def record(self, events: List[dict]):
+        """Sink del pipeline: agrega un lote de eventos"""
+        with self._lock:
+            for event in events:
+                target = event.get("to")
+                if not target:
+                    continue
+                method, path = event.get("method") or "HTTP", event.get("path") or "/"
+                weights = {
+                    "count": 1.0,
+                    "errors": 1.0 if (event.get("status") or 0) >= 500 else 0.0,
+                    "latency": float(event.get("duration") or 0),
+                }
+                sketches = self._target(target)
+                for metric, weight in weights.items():
+                    sketches[metric].add((method, path), weight)
+                    self._fleet[metric].add((target, method, path), weight)
+
+    def query(self, by: str = "count", target: Optional[str] = None, limit: int = 20) -> dict:
+        """Endpoints con mayor valor de la métrica, de un destino o de toda la flota"""
+        with self._lock:
+            if target is None:
+                sketch = self._fleet[by]
+                rows = [
+                    {"to": to, "method": method, "path": path, "value": round(value, 2), "max_error": round(error, 2)}
+                    for (to, method, path), value, error in sketch.top(limit)
+                ]
+            else:
+                sketches = self._targets.get(target)
+                sketch = sketches[by] if sketches is not None else None
+                rows = [] if sketch is None else [
+                    {"to": target, "method": method, "path": path, "value": round(value, 2), "max_error": round(error, 2)}
+                    for (method, path), value, error in sketch.top(limit)
+                ]
+            total = sketch.total if sketch is not None else 0.0
+        return {
+            "by": by,
+            "unit": TOP_METRICS[by],
+            "to": target,
+            "total": round(total, 2),
+            "items": rows,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "targets": len(self._targets),
+                "max_targets": self.max_targets,
+                "evicted_targets": self.evicted_targets,
+            }
@@ -14,6 +14,7 @@ from datetime import datetime
 # Configuración
 KUNNA_API_BASE = os.getenv("KUNNA_API_URL", "http://localhost:8000/api")
 KUNNA_API = f"{KUNNA_API_BASE}/services"
+KUNNA_SYNC_API = f"{KUNNA_API}/sync"
 SCAN_INTERVAL = 10  # Segundos entre escaneos
 DEBUG = True
 
@@ -178,6 +179,46 @@ def get_running_containers():
         log(f"Error conectando con Docker: {e}", "ERROR")
         return []
 
+def build_snapshot(containers):
+    """Construye el snapshot para /api/services/sync (incluye la presentación sugerida)"""
+    snapshot = []
+    for container in containers:
+        category = get_container_category(container['name'])
+        snapshot.append({
+            'id': container['id'],
+            'name': container['name'],
+            'image': container['image'],
+            'status': container['status'],
+            'port': container['port'],
+            'app_group': container['app_group'],
+            'networks': container['networks'],
+            'icon': get_container_icon(container['name']),
+            'category': category,
+            'color': get_container_color(category),
+        })
+    return snapshot
+
+def push_snapshot(containers):
+    """Envía el snapshot completo en una sola request.
+
+    Devuelve None si el backend no soporta el endpoint de sync (versión antigua).
+    """
+    try:
+        response = requests.post(
+            KUNNA_SYNC_API,
+            json={'server_id': None, 'containers': build_snapshot(containers)},
+            timeout=10,
+        )
+        if response.status_code in (404, 405):
+            return None
+        if response.status_code != 200:
+            log(f"⚠️ Sync rechazado por kuNNA: {response.text}", "WARNING")
+            return {}
+        return response.json()
+    except Exception as e:
+        log(f"❌ Error sincronizando con kuNNA: {e}", "ERROR")
+        return {}
+
 def sync_containers():
     """Sincroniza contenedores de Docker con kuNNA"""
     log("🔍 Escaneando contenedores Docker...")
@@ -190,7 +231,25 @@ def sync_containers():
         return
     
     log(f"Encontrados {len(containers)} contenedores")
-    
+
+    result = push_snapshot(containers)
+    if result is None:
+        # Backend sin /api/services/sync: una request por contenedor
+        sync_containers_legacy(containers)
+        return
+
+    for service in result.get('created', []):
+        log(f"✅ Registrado: {service['name']}")
+    if DEBUG:
+        for service in result.get('updated', []):
+            log(f"🧩 Patch service {service['id']}: {', '.join(service['fields'])}", "DEBUG")
+    for service in result.get('deleted', []):
+        log(f"🗑️ El contenedor {service['name']} ya no existe en el host local. Servicio eliminado de kuNNA.")
+    if DEBUG and result:
+        log(f"⏭️ {result.get('unchanged', 0)} servicios sin cambios", "DEBUG")
+
+def sync_containers_legacy(containers):
+    """Sincronización contenedor a contenedor (backends sin endpoint de sync)"""
     # Obtener servicios ya registrados
     existing_services = get_existing_services()
     
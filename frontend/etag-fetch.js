@@ -0,0 +1,20 @@
+// Cache de respuestas con ETag compartida por las páginas de kuNNA:
+// si el backend responde 304 se reutiliza el último cuerpo
+const etagCache = new Map();
+
+async function fetchWithETag(url) {
+    const cached = etagCache.get(url);
+    const response = await fetch(url, {
+        cache: 'no-store',
+        headers: cached ? { 'If-None-Match': cached.etag } : {}
+    });
+    if (response.status === 304 && cached) {
+        return { data: cached.data, changed: false };
+    }
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        etagCache.set(url, { etag, data });
+    }
+    return { data, changed: true };
+}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serialización de /api/services en kuNNA
+
+Compara la ruta previa (validación por item con response_model=List[Service]
++ jsonable_encoder + JSONResponse) con la ruta rápida (service_record +
+FastJSONResponse) para distintos tamaños de flota. Verifica además que ambas
+produzcan el mismo JSON.
+
+Uso:
+    python scripts/benchmarks/bench_json.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+# El backend crea su store y el log de tráfico al importarse: todo en un directorio temporal
+DATA_DIR = tempfile.mkdtemp(prefix="kunna-bench-")
+os.environ.setdefault("KUNNA_DATA_FILE", os.path.join(DATA_DIR, "services.json"))
+os.environ.setdefault("KUNNA_SQLITE_FILE", os.path.join(DATA_DIR, "services.db"))
+os.environ.setdefault("KUNNA_TRAFFIC_LOG_DIR", os.path.join(DATA_DIR, "traffic"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import app as backend  # noqa: E402
+import fast_json  # noqa: E402
+
+FLEET_SIZES = [1_000, 10_000, 50_000]
+REPEAT = 3
+
+
+def make_services(count):
+    """Mitad servicios locales del store, mitad contenedores remotos convertidos"""
+    services = []
+    for i in range(count):
+        if i % 2:
+            services.append(backend.remote_container_to_service({
+                "id": f"{i:012x}",
+                "name": f"container-{i}",
+                "image": "nginx:latest",
+                "status": "running" if i % 7 else "exited",
+                "ports": ["8080:80"] if i % 3 else ["internal:5000"],
+                "networks": [f"net-{i // 10}"],
+                "app_group": f"app-{i // 25}",
+                "server_id": f"10.0.{i // 1000}.1",
+                "server_hostname": f"host-{i // 1000}",
+                "server_ip": f"10.0.{i // 1000}.1",
+            }))
+        else:
+            services.append({
+                "id": str(i + 1),
+                "name": f"service-{i}",
+                "description": "Servicio sintético",
+                "url": f"http://localhost:{8000 + i % 1000}",
+                "icon": "🐳",
+                "category": "Docker Services",
+                "isActive": bool(i % 7),
+                "status": "running" if i % 7 else "exited",
+                "container_id": f"{i:012x}",
+                "app_group": f"app-{i // 25}",
+                "networks": [f"net-{i // 10}"],
+                "createdAt": "2024-12-14T16:00:00.000000",
+            })
+    return services
+
+
+RESPONSE_FIELD = create_response_field(name="Response_get_services", type_=List[backend.Service])
+
+
+def legacy_path(services):
+    """response_model=List[Service] + jsonable_encoder + JSONResponse"""
+    content = asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=services, is_coroutine=True))
+    return JSONResponse(content).body
+
+
+def fast_path(services):
+    """service_record + FastJSONResponse"""
+    return fast_json.FastJSONResponse([backend.service_record(s) for s in services]).body
+
+
+def timed(fn, services):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(services)
+        elapsed = (time.perf_counter() - start) * 1000  # ms
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    encoder = "orjson" if fast_json.orjson is not None else "json (stdlib)"
+    print(f"Encoder rápido: {encoder}\n")
+    print(f"{'servicios':>10} | {'previo (ms)':>12} | {'rápido (ms)':>12} | {'aceleración':>11}")
+    print("-" * 55)
+
+    for size in FLEET_SIZES:
+        services = make_services(size)
+        assert json.loads(legacy_path(services)) == json.loads(fast_path(services)), "las salidas difieren"
+
+        legacy_ms = timed(legacy_path, services)
+        fast_ms = timed(fast_path, services)
+        print(f"{size:>10} | {legacy_ms:>12.1f} | {fast_ms:>12.1f} | {legacy_ms / fast_ms:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
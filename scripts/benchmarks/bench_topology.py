@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark del modelo de topología incremental de kuNNA
+
+Compara el coste de una lectura de /api/topology con el modelo mantenido en
+memoria (snapshot versionado ya serializado) frente al recálculo completo que
+se hacía en cada request, para distintos tamaños de flota.
+
+Uso:
+    python scripts/benchmarks/bench_topology.py
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+from topology import TopologyModel, DefaultTopologyView  # noqa: E402
+
+FLEET_SIZES = [1_000, 5_000, 20_000]
+SERVICES_PER_NETWORK = 10
+READS = 200
+
+
+def make_services(count):
+    """Genera servicios sintéticos agrupados en redes de tamaño fijo"""
+    return [
+        {
+            "id": str(i + 1),
+            "name": f"service-{i}",
+            "status": "running" if i % 7 else "exited",
+            "isActive": bool(i % 7),
+            "icon": "🐳",
+            "app_group": f"app-{i // 25}",
+            "networks": [f"net-{i // SERVICES_PER_NETWORK}"],
+            "container_id": f"{i:012x}",
+        }
+        for i in range(count)
+    ]
+
+
+def legacy_topology(services):
+    """Recálculo completo (comportamiento previo de get_topology)"""
+    groups = {}
+    connections = []
+    for service in services:
+        app_group = service.get("app_group", "uncategorized")
+        if app_group not in groups:
+            groups[app_group] = {"id": app_group, "name": app_group, "services": []}
+        groups[app_group]["services"].append({
+            "id": service["id"],
+            "name": service["name"],
+            "status": service.get("status", "unknown"),
+            "isActive": service.get("isActive", True),
+            "icon": service.get("icon", "🔗"),
+            "networks": service.get("networks", []),
+            "is_remote": service.get("is_remote", False),
+            "server_hostname": service.get("server_hostname"),
+            "container_id": service.get("container_id"),
+        })
+    network_map = {}
+    for service in services:
+        for network in service.get("networks", []):
+            network_map.setdefault(network, []).append(service["id"])
+    for network, service_ids in network_map.items():
+        for i, source in enumerate(service_ids):
+            for target in service_ids[i+1:]:
+                connections.append({"source": source, "target": target, "network": network})
+    return json.dumps({
+        "groups": list(groups.values()),
+        "connections": connections,
+        "total_services": len(services),
+        "active_services": len([s for s in services if s.get("isActive", True)]),
+    }, ensure_ascii=False).encode('utf-8')
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6  # µs
+
+
+def main():
+    print(f"{'servicios':>10} | {'recálculo (µs)':>15} | {'modelo lectura (µs)':>20} | {'cambio + lectura (µs)':>22}")
+    print("-" * 78)
+
+    for size in FLEET_SIZES:
+        services = make_services(size)
+
+        model = TopologyModel(DefaultTopologyView())
+        model.sync_local(services)
+        model.snapshot_json()
+
+        legacy_us = timed(lambda: legacy_topology(services), max(3, READS // 50))
+        read_us = timed(model.snapshot_json, READS)
+
+        # Un cambio de estado invalida un grupo y fuerza una reconstrucción del snapshot
+        def change_and_read():
+            service = dict(services[0])
+            service["status"] = "exited" if service["status"] == "running" else "running"
+            services[0] = service
+            model.apply_store_changes([('put', service["id"], service)])
+            model.snapshot_json()
+
+        change_us = timed(change_and_read, max(3, READS // 50))
+
+        print(f"{size:>10} | {legacy_us:>15.1f} | {read_us:>20.2f} | {change_us:>22.1f}")
+
+
+if __name__ == "__main__":
+    main()